@@ -0,0 +1,115 @@
+"""
+Measure the per-call overhead of the AcuControl interface with the
+standard backend, without any network I/O: a null backend answers
+every request immediately with a canned decoded result.
+
+For comparison, the same calls are timed through the previous
+trampoline (the per-instance api_decorator wrapping, isinstance checks
+and exception handling), reproduced below -- except that it takes
+return values from StopIteration, as the AcuControl methods no longer
+use returnValue.
+"""
+
+import argparse
+import time
+import types
+from functools import wraps
+
+import soaculib
+from soaculib import standard_backend as sb
+
+
+class NullBackend(soaculib.StandardBackend):
+    """Standard backend that doesn't touch the network."""
+    def execute(self, req):
+        if req.decoder.rtype == 'json':
+            yield {'Mode': 'Stop'}
+        else:
+            yield 'OK, Command executed.'
+
+
+def old_api_decorator(f):
+    @wraps(f)
+    def wrapped(*args, **kwargs):
+        gen = f(*args, **kwargs)
+        val = None
+        while True:
+            try:
+                if isinstance(val, types.GeneratorType):
+                    val = next(val)
+                val = gen.send(val)
+            except StopIteration as stop:
+                if stop.value is not None:
+                    val = stop.value
+                break
+            except sb._ReturnValue as rv:
+                val = rv.value
+                break
+        return val
+    return wrapped
+
+
+def old_unyielding_decorator(f):
+    api = old_api_decorator(f)
+
+    @wraps(f)
+    def wrapped(*args, **kwargs):
+        yield api(*args, **kwargs)
+    return wrapped
+
+
+def old_style(acu):
+    """Re-wrap acu's methods as AcuControl used to, on the instance."""
+    for name in acu.INTERFACE + acu.PASSTHROUGH:
+        func = getattr(type(acu), '_' + name).__get__(acu)
+        setattr(acu, '_' + name, old_unyielding_decorator(func))
+        setattr(acu, name, old_api_decorator(func))
+    return acu
+
+
+def bench(func, n, repeat=5):
+    """Best time per call (s) over several repeats of n calls."""
+    best = None
+    for r in range(repeat):
+        t0 = time.perf_counter()
+        for i in range(n):
+            func()
+        dt = (time.perf_counter() - t0) / n
+        if best is None or dt < best:
+            best = dt
+    return best
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', '-n', type=int, default=20000)
+    return parser
+
+
+if __name__ == '__main__':
+    args = get_parser().parse_args()
+    cfg = soaculib.guess_config('simulator')
+    new = soaculib.AcuControl(cfg, backend=NullBackend())
+    old = old_style(soaculib.AcuControl(cfg, backend=NullBackend()))
+    http = new.http
+
+    calls = [
+        ('http.Values (no wrapper)',
+         lambda a: (lambda: next(http.Values('DataSets.Status')))),
+        ('Values', lambda a: (lambda: a.Values('DataSets.Status'))),
+        ('Command', lambda a: (lambda: a.Command('DataSets.X', 'Y'))),
+        ('mode()', lambda a: (lambda: a.mode())),
+        ('go_to(1, 2)', lambda a: (lambda: a.go_to(1., 2.))),
+        ('set_rate(az=1)', lambda a: (lambda: a.set_rate(az=1.))),
+    ]
+    print(f'{"call":<26} {"old (us)":>10} {"new (us)":>10}')
+    for label, make in calls:
+        t_old = bench(make(old), args.count) * 1e6
+        t_new = bench(make(new), args.count) * 1e6
+        print(f'{label:<26} {t_old:10.2f} {t_new:10.2f}')
+
+    t_old = bench(lambda: old_style(soaculib.AcuControl(
+        cfg, backend=NullBackend())), 100) * 1e6
+    t_new = bench(lambda: soaculib.AcuControl(cfg, backend=NullBackend()),
+                  100) * 1e6
+    print(f'{"AcuControl()":<26} {t_old:10.2f} {t_new:10.2f}')
@@ -1,10 +1,10 @@
 from .acu import *
-from .streams import BroadcastStreamControl
+from .streams import BroadcastStreamControl, BroadcastStreamGroup, StreamSchema
 
 from .backend import _Backend, get_backend
 from .standard_backend import StandardBackend, DebuggingBackend
 
-from .configs import guess_config, get_stream_schema
+from .configs import guess_config, get_stream_schema, get_schema_dtype
 from . import http
 from . import util
 from . import cli
@@ -1,6 +1,10 @@
 import soaculib
 import enum
+import functools
 import os
+import time
+
+from .http import HttpDecoder, CommandDecoder, CommandError, command_ok
 
 class ValuesType(enum.Enum):
     Actual = 'Actual'
@@ -23,7 +27,26 @@ class DocumentationType(enum.Enum):
 
 class AculibError(Exception):
     pass
-    
+
+
+class _ObservedDecoder:
+    """Wraps a decoder, passing each decoded result to some observer
+    functions, as observer(plugin, params, result)."""
+    def __init__(self, decoder, observers, plugin, params):
+        if isinstance(decoder, str):
+            decoder = HttpDecoder(decoder)
+        self.decoder = decoder
+        self.rtype = getattr(decoder, 'rtype', None)
+        self.observers = observers
+        self.plugin = plugin
+        self.params = params
+
+    def __call__(self, resp_code, text):
+        result = self.decoder(resp_code, text)
+        for observer in self.observers:
+            observer(self.plugin, self.params, result)
+        return result
+
 class AcuHttpInterface:
     """This class constructs HTTP requests of the kind described in the
     ACU ICD.  There is a method defined for each of the main "Plugins"
@@ -38,25 +61,49 @@ class AcuHttpInterface:
     not completed).  Depending on the backend in use, the result might
     be a Deferred object, or the decoded result.
 
+    Functions in self.observers are called as observer(plugin, params,
+    result) with the decoded result of every successful Values and
+    Command request (plugin is 'Values' or 'Command', and params is
+    the dict of HTTP query parameters).
+
     """
     def __init__(self, base_url, backend=None):
         self.base_url = base_url
         if backend is None:
             backend = soaculib.DebuggingBackend()
         self.backend = backend
+        self.observers = []
+
+    def _decoder(self, decoder, plugin, params):
+        if not self.observers:
+            return decoder
+        return _ObservedDecoder(decoder, self.observers, plugin, params)
 
     def Values(self, identifier, type_='Actual', format_='JSON'):
         type_ = ValuesType(type_) # validate
         format_ = ValuesFormat(format_) # validate
+        params = {
+            'identifier': identifier,
+            'type': type_.name,
+            'format': format_.name}
         req = soaculib.http.HttpRequest(
-            'GET', self.base_url + '/Values', {
-                'identifier': identifier,
-                'type': type_.name,
-                'format': format_.name},
-            decoder='json')
+            'GET', self.base_url + '/Values', params,
+            decoder=self._decoder('json', 'Values', params))
         return self.backend(req)
 
-    def Command(self, identifier, command, parameter=None):
+    def Command(self, identifier, command, parameter=None, check=True):
+        """Send a command to the "Command" Plugin.  The parameter may
+        be a string, or a list of strings (which will be joined with
+        '|').
+
+        If check, the response is validated as it is decoded: the
+        result is the success string (e.g. 'OK, Command executed.'),
+        and any other response causes soaculib.http.CommandError to
+        be raised, with the identifier, command and parameter
+        attached.  If not check, the response text is returned
+        whatever it is.
+
+        """
         if isinstance(parameter, list):
             parameter = '|'.join(parameter)
         http_params = {
@@ -66,7 +113,10 @@ class AcuHttpInterface:
         if parameter is not None:
             http_params['parameter'] = parameter
         req = soaculib.http.HttpRequest(
-            'GET', self.base_url + '/Command', http_params)
+            'GET', self.base_url + '/Command', http_params,
+            decoder=self._decoder(
+                CommandDecoder(http_params) if check else 'unknown',
+                'Command', http_params))
         return self.backend(req)
 
     def Write(self, identifier, data):
@@ -166,10 +216,120 @@ class Mode(enum.Enum):
     UnStow = 'UnStow'
 
 
+class CommandBatch:
+    """A set of Commands (and Values queries) to be sent together,
+    e.g. to set up a motion with the minimum number of round trips.
+
+    Requests are grouped into stages, separated by calls to
+    barrier().  The requests in a stage are issued concurrently (over
+    the AcuControl's connection pool), and a stage is only started
+    once every request in the previous stage has returned -- so
+    ordering constraints, such as setting a position before changing
+    the mode, can be expressed by putting the second command in a
+    later stage.  If any Command in a stage fails, later stages are
+    not sent.
+
+    Usage (standard backend)::
+
+      batch = acu.batch()
+      batch.command('DataSets.CmdAzElPositionTransfer',
+                    'Set Azimuth Elevation', ['180.0000', '60.0000'])
+      batch.barrier()
+      batch.command('DataSets.CmdModeTransfer', 'SetAzElMode', 'Preset')
+      results = batch.run()
+
+    Attributes:
+      stages (list): Lists of (index, plugin, args) for each stage.
+      errors (list): After run(), (index, CommandError) for each
+        failed Command.
+
+    """
+    def __init__(self, acu):
+        self.acu = acu
+        self.stages = [[]]
+        self.count = 0
+        self.errors = []
+
+    def _add(self, plugin, args):
+        self.stages[-1].append((self.count, plugin, args))
+        self.count += 1
+        return self.count - 1
+
+    def command(self, identifier, command, parameter=None):
+        """Add a Command to the current stage.  Returns the index of
+        its result."""
+        return self._add('Command', (identifier, command, parameter))
+
+    def values(self, identifier, type_='Actual', format_='JSON'):
+        """Add a Values query to the current stage.  Returns the index
+        of its result."""
+        return self._add('Values', (identifier, type_, format_))
+
+    def label(self, index):
+        """Short description of request index, for messages."""
+        for stage in self.stages:
+            for i, plugin, args in stage:
+                if i == index:
+                    return f'{plugin}{args}'
+
+    def barrier(self):
+        """Start a new stage; subsequent requests will only be sent
+        once all the requests added so far have completed."""
+        if len(self.stages[-1]):
+            self.stages.append([])
+
+    def run(self, check=True):
+        """Send the requests; see AcuControl.run_batch."""
+        return self.acu.run_batch(self, check=check)
+
+
 class AcuControl:
     """High level interface to ACU platform control.
 
+    The public methods are created on instantiation by decorating the
+    private generator methods for the chosen backend; see
+    soaculib.backend.bind_interface.
+
+    The stream controllers (self.streams) share the backend, so with
+    persistent=True the remote and developer interface requests all
+    reuse connections from one pool.  The number of connections kept
+    per host may be set with 'http_pool_size' in the config block.
+
+    The axis modes are tracked locally, from the mode commands that
+    succeed and from any Values results (status datasets, or
+    Antenna.SkyAxes) that carry them; see known_modes().  When a mode
+    command only specifies some of the axes, the others are filled in
+    from this state if it is fresh enough, rather than by querying the
+    ACU.
+
     """
+    #: Maximum age (s) of a tracked axis mode, for it to be used
+    #: instead of querying the ACU.
+    mode_cache_age = 2.
+
+    #: Axis names used by known_modes, in SetModes order.
+    MODE_AXES = ['Azimuth', 'Elevation', 'Third']
+
+    # Status dataset fields that carry the axis modes.
+    _MODE_FIELDS = {
+        'Azimuth mode': 'Azimuth',
+        'Elevation mode': 'Elevation',
+        'Boresight mode': 'Third',
+        'Co-Rotator mode': 'Third',
+    }
+
+    # Antenna.SkyAxes sub-modules, by axis.
+    _SKY_AXES = {
+        'Azimuth': 'Antenna.SkyAxes.Azimuth',
+        'Elevation': 'Antenna.SkyAxes.Elevation',
+        'Third': 'Antenna.SkyAxes.Polarisation',
+    }
+
+    INTERFACE = ['mode', 'azmode', 'set_elsync', 'set_rate',
+                 'go_to', 'go_3rd_axis', 'stop', 'clear_faults',
+                 'run_batch', 'UploadPtStack']
+    PASSTHROUGH = ['Values', 'Command', 'Write']
+
     def __init__(self, config='guess', backend=None, readonly=False,
                  persistent=False):
         self._config = soaculib.guess_config(config)
@@ -178,25 +338,111 @@ class AcuControl:
         else:
             base_url = self._config['base_url']
 
-        backend = soaculib.get_backend(backend, persistent=persistent)
+        backend = soaculib.get_backend(
+            backend, persistent=persistent,
+            pool_size=self._config.get('http_pool_size'))
         self.http = AcuHttpInterface(base_url, backend=backend)
         self.streams = soaculib.streams.BroadcastStreamControl.get_all(
             self._config, backend=backend)
 
-        # Decorate all methods for the chosen backend.
-        for public_name in ['mode', 'azmode', 'set_elsync', 'set_rate',
-                            'go_to', 'go_3rd_axis', 'stop',
-                            'clear_faults',
-                            'Values', 'Command', 'Write', 'UploadPtStack']:
-            func = getattr(self, '_' + public_name)
-            setattr(self, '_' + public_name, backend.decorator(func))
-            setattr(self, public_name, backend.api_decorator(func))
+        # Map from axis to (mode, time.monotonic() when seen).
+        self._modes = {}
+        self.http.observers.append(self._observe)
+
+        # Decorate all methods for the chosen backend.  The plugin
+        # pass-throughs call straight through to self.http, where the
+        # backend allows.
+        soaculib.backend.bind_interface(self, self.INTERFACE, backend, {
+            name: getattr(self.http, name) for name in self.PASSTHROUGH})
         # Define the appropriate returnValue function.
         self._return_val_func = backend.return_val_func
 
     def _return(self, value):
         self._return_val_func(value)
 
+    def _observe(self, plugin, params, result):
+        """Update the tracked axis modes from a request result."""
+        now = time.monotonic()
+        identifier = params.get('identifier', '')
+        if plugin == 'Values' and isinstance(result, dict):
+            for axis, ident in self._SKY_AXES.items():
+                if identifier.lower() == ident.lower() and 'Mode' in result:
+                    self._modes[axis] = (result['Mode'], now)
+            for k, axis in self._MODE_FIELDS.items():
+                if k in result:
+                    self._modes[axis] = (result[k], now)
+        elif (plugin == 'Command' and identifier == 'DataSets.CmdModeTransfer'
+              and command_ok(result)):
+            cmd, param = params.get('command'), params.get('parameter')
+            if cmd == 'Stop':
+                modes = ['Stop'] * 3
+            elif cmd == 'SetAzElMode':
+                modes = [param, param]
+            elif cmd == 'SetModes':
+                modes = param.split('|')
+            elif cmd == 'Set3rdAxisMode':
+                modes = [None, None, param]
+            else:
+                return
+            for axis, mode in zip(self.MODE_AXES, modes):
+                if mode is not None:
+                    self._modes[axis] = (mode, now)
+
+    def known_modes(self, max_age=None):
+        """Return the locally tracked axis modes, as a dict from axis
+        ('Azimuth', 'Elevation', 'Third') to mode string.  Only modes
+        updated within max_age seconds (default: mode_cache_age) are
+        included.
+
+        """
+        if max_age is None:
+            max_age = self.mode_cache_age
+        cutoff = time.monotonic() - max_age
+        return {axis: mode for axis, (mode, t) in self._modes.items()
+                if t >= cutoff}
+
+    def update_modes(self, data):
+        """Update the tracked axis modes from a status dataset (dict)
+        obtained some other way."""
+        self._observe('Values', {}, data)
+
+    def batch(self):
+        """Return a new, empty CommandBatch for this ACU."""
+        return CommandBatch(self)
+
+    def _run_batch(self, batch, check=True):
+        """Send the requests in a CommandBatch, stage by stage.
+
+        Returns a list with the result of each request, in the order
+        they were added (None for any not sent because a Command in an
+        earlier stage failed).  The Commands are sent with
+        check=False, so one failure doesn't abort the rest of its
+        stage; failures are recorded in batch.errors, as (index,
+        CommandError).  If check, and there were any, the first
+        CommandError is raised once the batch has completed.
+
+        """
+        backend = self.http.backend
+        results = [None] * batch.count
+        batch.errors = []
+        for stage in batch.stages:
+            if not stage:
+                continue
+            stage_results = yield from soaculib.backend.gather(backend, [
+                functools.partial(self.Command, *args, check=False)
+                if plugin == 'Command' else
+                functools.partial(self.Values, *args)
+                for _, plugin, args in stage])
+            for (i, plugin, args), r in zip(stage, stage_results):
+                results[i] = r
+                if plugin == 'Command' and not command_ok(r):
+                    batch.errors.append((i, CommandError(*args, r)))
+            if batch.errors:
+                break
+        if check and batch.errors:
+            raise batch.errors[0][1]
+        return results
+
     def _mode(self, mode=None, size=0):
         """Query or set the Antenna.SkyAxes modes.
 
@@ -253,7 +499,12 @@ class AcuControl:
         else:
             assert(len(mode) in [2, 3])
             if any([m is None for m in mode]):
-                # Fill in the missing ones.
+                # Fill in the missing ones, from the tracked modes if
+                # possible.
+                known = self.known_modes()
+                mode = [known.get(axis) if m is None else m
+                        for axis, m in zip(self.MODE_AXES, mode)]
+            if any([m is None for m in mode]):
                 _mode = (yield self.mode(size=len(mode)))
                 mode = [b if a is None else a
                         for a, b in zip(mode, _mode)]
@@ -261,7 +512,7 @@ class AcuControl:
             # Note this returns "OK, Command send." on success.
             result = yield self.http.Command(
                 'DataSets.CmdModeTransfer', 'SetModes', modes)
-        self._return(result)
+        return result
 
     def _azmode(self, mode=None):
         """Set the Antenna.SkyAxes mode for the Azimuth axis and set the
@@ -273,7 +524,7 @@ class AcuControl:
         mode = Mode(mode)
         result = yield self.http.Command(
             'DataSets.CmdModeTransfer', 'SetModes', [mode.value, 'Stop'])
-        self._return(result)
+        return result
 
     def _go_to(self, az=None, el=None, set_mode=True):
         """Optionally update the Preset position target (az, el, neither, or
@@ -288,10 +539,18 @@ class AcuControl:
         - if set_mode='target', *only* the axes for which a new target
           position was specified will have their mode updated.
 
+        If the position command is refused, soaculib.http.CommandError
+        is raised and the modes are not changed.
+
         """
         # Set the position first, then the mode.  Otherwise you might
         # rush to some random position (e.g. if ACU just rebooted).
+        # The position command is sent together with any mode queries
+        # needed to fill in the mode command, which is only sent if the
+        # position command succeeded.
+        batch = self.batch()
         result = None
+        pos_index = None
         modes = [None, None]
         if az is not None or el is not None:
             cmd, par = [], []
@@ -303,24 +562,38 @@ class AcuControl:
                 cmd.append('Elevation')
                 par.append('%.4f' % el)
                 modes[1] = 'Preset'
-            result = yield self.http.Command(
-                'DataSets.CmdAzElPositionTransfer',
-                'Set ' + ' '.join(cmd), par)
+            pos_index = batch.command('DataSets.CmdAzElPositionTransfer',
+                                      'Set ' + ' '.join(cmd), par)
+
+        queries = [None, None]
+        if set_mode in ['target'] and any([m is not None for m in modes]):
+            known = self.known_modes()
+            modes = [known.get(axis) if m is None else m
+                     for axis, m in zip(self.MODE_AXES, modes)]
+            queries = [None if m is not None else
+                       batch.values(self._SKY_AXES[axis])
+                       for axis, m in zip(self.MODE_AXES, modes)]
+
+        results = yield self._run_batch(batch)
+        if pos_index is not None:
+            result = results[pos_index]
 
         if set_mode in ['target']:
             if any([m is not None for m in modes]):
+                modes = [m if q is None else results[q]['Mode']
+                         for m, q in zip(modes, queries)]
                 result = yield self._mode(modes)
         elif set_mode:
             result = yield self._mode('Preset')
         else:
             pass
 
-        self._return(result)
+        return result
 
     def _set_elsync(self):
         result = yield self.http.Command(
             'DataSets.CmdModeTransfer', 'Set3rdAxisMode', 'ElSync')
-        self._return(result)
+        return result
 
     def _set_rate(self, az=None, el=None, third=None,
                   set_mode=True):
@@ -340,26 +613,34 @@ class AcuControl:
             'th': None,
         }
 
+        # The velocity commands, and any mode queries needed to fill in
+        # the mode command, are all sent at once.
+        batch = self.batch()
         for axis, val in [('az', az), ('el', el), ('th', third)]:
             if val is None or val is False:
                 continue
-            if isinstance(val, (float, int)):
+            if isinstance(val, (float, int)) and val is not True:
                 ds, name = vel_sets[axis]
-                result = yield self.http.Command(ds, name, '%f' % val)
-                print(result)
+                batch.command(ds, name, '%f' % val)
             if val is True or set_mode:
                 modes[axis] = 'Rate'
         # If third mode is None, drop it ...
         if modes['th'] is None:
             del modes['th']
         # If either of the other two are None, backfill them.
-        if modes['az'] is None or modes['el'] is None:
-            cur_modes = yield self._mode(None, size=2)
-            if modes['az'] is None:
-                modes['az'] = cur_modes[0]
-            if modes['el'] is None:
-                modes['el'] = cur_modes[1]
-        yield self._mode([v for v in modes.values()])
+        queries = {}
+        known = self.known_modes()
+        for axis, name in [('az', 'Azimuth'), ('el', 'Elevation')]:
+            if modes[axis] is None:
+                modes[axis] = known.get(name)
+            if modes[axis] is None:
+                queries[axis] = batch.values(self._SKY_AXES[name])
+
+        results = yield self._run_batch(batch)
+        for axis, index in queries.items():
+            modes[axis] = results[index]['Mode']
+        result = yield self._mode([v for v in modes.values()])
+        return result
 
     def _go_3rd_axis(self, val):
         """Change 3rd axis to Preset mode and move to specified position.
@@ -376,7 +657,7 @@ class AcuControl:
         # Set mode.
         yield self.http.Command(
             'DataSets.CmdModeTransfer', 'Set3rdAxisMode', 'Preset')
-        self._return(result)
+        return result
 
     def _stop(self):
         """Special request to set all axes, including 3rd Axis, to Stop mode.
@@ -384,22 +665,23 @@ class AcuControl:
         """
         result = yield self.http.Command(
             'DataSets.CmdModeTransfer', 'Stop')
-        self._return(result)
+        return result
 
     def _clear_faults(self):
         """Clear any axis faults (Failure Reset)."""
         result = yield self.http.Command('DataSets.CmdGeneralTransfer',
                                          'Failure Reset')
-        self._return(result)
+        return result
 
     # Pass-throughs for plugin primitives
     def _Values(self, identifier, type_='Actual', format_='JSON'):
         """See documentation for AcuHttpInterface.Values."""
         return (yield self.http.Values(identifier, type_, format_))
 
-    def _Command(self, identifier, command, parameter=None):
+    def _Command(self, identifier, command, parameter=None, check=True):
         """See documentation for AcuHttpInterface.Command."""
-        return (yield self.http.Command(identifier, command, parameter))
+        return (yield self.http.Command(identifier, command, parameter,
+                                        check=check))
 
     def _Write(self, identifier, data):
         """See documentation for AcuHttpInterface.Write."""
@@ -1,7 +1,12 @@
 import soaculib
+import types
 
 class _Backend:
     """Backend interface.  Abstract Base Class."""
+    #: Optional decorator for pass-through functions; see
+    #: bind_interface.
+    passthrough_decorator = None
+
     def __init__(self):
         self.decorator = None
         self.api_decorator = None
@@ -15,14 +20,72 @@ class _Backend:
         return self.execute(*args, **kw)
 
 
-def get_backend(backend=None, persistent=None):
+def get_backend(backend=None, persistent=None, pool_size=None):
     if isinstance(backend, _Backend):
         return backend
     if backend is None or backend == 'standard':
-        return soaculib.StandardBackend(persistent=persistent)
+        return soaculib.StandardBackend(persistent=persistent,
+                                        pool_size=pool_size)
     if backend == 'twisted':
         from soaculib.twisted_backend import TwistedHttpBackend
-        return TwistedHttpBackend(persistent=persistent)
+        return TwistedHttpBackend(persistent=persistent, pool_size=pool_size)
     if backend == 'debug':
         return soaculib.DebuggingBackend()
     raise ValueError("Unknown backend request: %s" % backend)
+
+
+def gather(backend, funcs):
+    """Generator that runs the functions in funcs (with no arguments)
+    using backend.gather, so they can proceed concurrently, and
+    returns the list of results.  If the backend has no gather, the
+    functions are called (and their results waited for) one at a time.
+    Use it from generator methods as::
+
+      results = yield from soaculib.backend.gather(backend, funcs)
+
+    """
+    if getattr(backend, 'gather', None) is not None:
+        results = yield backend.gather(funcs)
+    else:
+        results = []
+        for f in funcs:
+            results.append((yield f()))
+    return results
+
+
+# Decorated generator methods, keyed by (class, method name, decorator).
+_decorated = {}
+
+
+def bind_interface(obj, names, backend, passthrough=None):
+    """Set up the public interface of obj (such as an AcuControl) for
+    the chosen backend.
+
+    For each name in names, the generator method obj._name is replaced
+    (on obj) by its backend.decorator version, and obj.name is set to
+    its backend.api_decorator version.  The decorated functions are
+    created once per class (and decorator), and are simply bound to
+    obj here.
+
+    The passthrough argument is a dict mapping more public names to
+    functions that return a backend request result directly (such as
+    obj.http.Values).  If the backend has a passthrough_decorator,
+    obj.name is set to passthrough_decorator(func), bypassing the
+    generator method; otherwise the name is handled as above.
+
+    """
+    cls = type(obj)
+    if passthrough is None:
+        passthrough = {}
+    pass_dec = getattr(backend, 'passthrough_decorator', None)
+    for name in list(names) + list(passthrough):
+        for attr, dec in [('_' + name, backend.decorator),
+                          (name, backend.api_decorator)]:
+            if attr == name and name in passthrough and pass_dec is not None:
+                setattr(obj, name, pass_dec(passthrough[name]))
+                continue
+            key = (cls, name, dec)
+            func = _decorated.get(key)
+            if func is None:
+                func = _decorated[key] = dec(getattr(cls, '_' + name))
+            setattr(obj, attr, types.MethodType(func, obj))
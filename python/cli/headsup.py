@@ -6,19 +6,40 @@ information in a table.
 """
 
 
+import collections
 import curses
+import os
+import queue
+import socket
+import threading
 import time, calendar
 import json
 
 import soaculib
 
 
+def addstr(w, row, col, text, attr):
+    # Writing the bottom right corner of a window raises an error
+    # (because the cursor can't advance), though the text is drawn.
+    try:
+        w.addstr(row, col, text, attr)
+    except curses.error:
+        pass
+
+
 class Renderer(list):
     # Items in the list are actually formatting instructions for data;
     # tuples of the form:
     #    ('header', label, None)
     #    ('item', label, key)
     #
+    # To keep the terminal traffic down, the screen position and
+    # formatter of each visible item are worked out only when the
+    # layout or view changes (see _place), and the value last drawn
+    # in each cell is remembered, so that only cells whose value has
+    # changed are redrawn.  Render calls noutrefresh; the caller
+    # should follow up with curses.doupdate().
+    #
     def __init__(self, height, width):
         self.height = height -1
         self.scr_width = width
@@ -26,30 +47,51 @@ class Renderer(list):
         self.n_cols = int(self.scr_width / self.width)
         self.offset = 0
         self.truncate = True
+        # List of (row, col, key, formatter, attr) for visible items;
+        # None if it needs to be recomputed.
+        self.slots = None
+        # Map from (row, col) to the value last drawn there.
+        self.cells = {}
 
-    def render(self, w, data):
-        if len(self) == 0:
-            w.clear()
-            groups = {'time': [], 'az': [], 'el': [], 'other': []}
-            for k in data.keys():
-                if k in ['Time', 'Year', 'human-time*', 'ctime*']:
-                    groups['time'].append((k.lower(), k))
-                elif k.startswith('Azimuth'):
-                    groups['az'].append((k.lower().replace('azimuth ',''), k))
-                elif k.startswith('Elevation'):
-                    groups['el'].append((k.lower().replace('elevation ',''), k))
-                else:
-                    groups['other'].append((k.lower(), k))
-            for k, label in [('time', 'Time Parameters'),
-                             ('az', 'Azimuth'),
-                             ('el', 'Elevation'),
-                             ('other', 'Other')]:
-                if len(groups[k]) == 0:
-                    continue
-                self.append(('header', label + ' '*(self.width-len(label)), None))
-                for v in groups[k]:
-                    self.append(('item', v[0], v[1]))
-        col_i = 0
+    def _layout(self, data):
+        groups = {'time': [], 'az': [], 'el': [], 'other': []}
+        for k in data.keys():
+            if k in ['Time', 'Year', 'human-time*', 'ctime*']:
+                groups['time'].append((k.lower(), k))
+            elif k.startswith('Azimuth'):
+                groups['az'].append((k.lower().replace('azimuth ',''), k))
+            elif k.startswith('Elevation'):
+                groups['el'].append((k.lower().replace('elevation ',''), k))
+            else:
+                groups['other'].append((k.lower(), k))
+        for k, label in [('time', 'Time Parameters'),
+                         ('az', 'Azimuth'),
+                         ('el', 'Elevation'),
+                         ('other', 'Other')]:
+            if len(groups[k]) == 0:
+                continue
+            self.append(('header', label, None))
+            for v in groups[k]:
+                self.append(('item', v[0], v[1]))
+
+    def _formatter(self, label):
+        # Returns a function that renders a value string into a cell
+        # of exactly self.width characters, so it overwrites whatever
+        # was drawn there before.
+        width = self.width
+        prefix = ' ' + label
+        room = width - len(prefix)
+        def fmt(v):
+            if len(v) > width:
+                return v[:width-3] + '...'
+            spaces = width - len(label) - len(v)
+            if spaces < 2:
+                return (' ' + label[:spaces-2] + '|' + v)[:width]
+            return prefix + v.rjust(room)
+        return fmt
+
+    def _place(self):
+        self.slots = []
         for i, (type_, label, key) in enumerate(self[self.offset:]):
             col_i = i // self.height
             row = i - col_i*self.height
@@ -57,17 +99,32 @@ class Renderer(list):
             if col_i >= self.n_cols:
                 break
             if type_ == 'header':
-                w.addstr(row,col,label,curses.A_BOLD | curses.A_REVERSE)
+                text = (label + ' '*self.width)[:self.width]
+                self.slots.append((row, col, None, text,
+                                   curses.A_BOLD | curses.A_REVERSE))
             else:
-                v = str(data[key])
-                spaces = self.width - len(label) - len(v)
-                if len(v) > self.width:
-                    text = v[:self.width-3] + '...'
-                elif spaces < 2:
-                    text = ' ' + label[:spaces-2] + '|' + v
-                else:
-                    text = ' ' + label + ' ' * spaces + v
-                w.addstr(row, col, text, curses.A_DIM)
+                self.slots.append((row, col, key, self._formatter(label),
+                                   curses.A_DIM))
+
+    def render(self, w, data):
+        if len(self) == 0:
+            self._layout(data)
+        if self.slots is None:
+            w.erase()
+            self.cells = {}
+            self._place()
+            for row, col, key, text, attr in self.slots:
+                if key is None:
+                    addstr(w, row, col, text, attr)
+        cells = self.cells
+        for row, col, key, fmt, attr in self.slots:
+            if key is None:
+                continue
+            v = str(data[key])
+            if cells.get((row, col)) != v:
+                addstr(w, row, col, fmt(v), attr)
+                cells[(row, col)] = v
+        w.noutrefresh()
 
     def update_view(self, step=None, page=None, home=None, end=None,
                     width=None, truncate=None):
@@ -83,36 +140,330 @@ class Renderer(list):
         if width is not None:
             self.width = max(1, self.width + width)
             self.n_cols = int(self.scr_width / self.width)
-            self.clear()
+            self.slots = None
         if truncate is not None and truncate != self.truncate:
             self.truncate = truncate
-            self.clear()
+            self.slots = None
         new_offset = max(0, min(new_offset, len(self)-1))
         if new_offset != self.offset:
-            self.clear()
+            self.slots = None
             self.offset = new_offset
 
 
 class Recorder:
+    """Record dataset snapshots to file, as newline-delimited JSON.
+    Each line is a complete record::
+
+      {"time": <query time>, "dataset": <dataset name>, "data": {...}}
+
+    so a recording is readable up to the last complete line, even if
+    the program dies.  Records are appended if the file exists.
+
+    save_block only queues the record; the file is opened, and records
+    are encoded and written, by a background thread, which flushes and
+    fsyncs the file every fsync_period seconds.  If max_bytes is set,
+    then once the file exceeds that size it's closed and recording
+    continues in a new file, with a counter added to the name (e.g.
+    rec.ndjson, rec.1.ndjson, rec.2.ndjson, ...).  If the file can't be
+    opened or written, the reason is stored in self.error.
+
+    If filename is None, nothing is recorded.  Call close() to stop
+    recording; it returns once everything queued has been written.
+
+    """
     filename, fout = None, None
-    def __init__(self, filename=None):
-        if filename is not None:
-            self.filename = filename
-            self.fout = open(filename, 'w')
-            self.n = 0
-    def __del__(self):
+    def __init__(self, filename=None, fsync_period=5., max_bytes=None):
+        self.error = None
+        if filename is None:
+            return
+        self.base_filename = filename
+        self.fsync_period = fsync_period
+        self.max_bytes = max_bytes
+        self.n = 0
+        self.n_files = 0
+        self._queue = queue.Queue()
+        self.fout = None
+        self.filename = filename
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _open(self):
         if self.fout is not None:
-            self.fout.write(']\n')
+            self._sync()
             self.fout.close()
-    def save_block(self, data):
-        if self.fout is not None:
-            if self.n == 0:
-                self.fout.write('[\n')
+        filename = self.base_filename
+        if self.n_files:
+            root, ext = os.path.splitext(filename)
+            filename = f'{root}.{self.n_files}{ext}'
+        self.n_files += 1
+        self.fout = open(filename, 'a')
+        self.filename = filename
+
+    def _sync(self):
+        self.fout.flush()
+        os.fsync(self.fout.fileno())
+
+    def _run(self):
+        next_sync = time.time() + self.fsync_period
+        try:
+            self._open()
+            while True:
+                try:
+                    item = self._queue.get(
+                        timeout=max(0, next_sync - time.time()))
+                except queue.Empty:
+                    item = ()
+                if item is None:
+                    break
+                if item:
+                    t, dataset, data = item
+                    self.fout.write(json.dumps({'time': t, 'dataset': dataset,
+                                                'data': data}) + '\n')
+                    self.n += 1
+                    if (self.max_bytes is not None
+                        and self.fout.tell() >= self.max_bytes):
+                        self._open()
+                if time.time() >= next_sync:
+                    self._sync()
+                    next_sync = time.time() + self.fsync_period
+        except Exception as e:
+            self.error = f'{e.__class__.__name__}: {e}'
+        finally:
+            if self.fout is not None:
+                self.fout.close()
+
+    def save_block(self, data, dataset=None, t=None):
+        if self.filename is not None and self.error is None:
+            if t is None:
+                t = time.time()
+            self._queue.put((t, dataset, data))
+
+    def close(self):
+        if self.filename is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self.filename = None
+
+
+class Poller:
+    """Query a dataset at a steady cadence, in a background thread, so
+    that a slow ACU response doesn't hold up the UI.
+
+    Only the most recent result is kept, in a single slot; the UI
+    takes it with get().  If a result is replaced before the UI has
+    taken it, that's counted in self.dropped.  If a query takes longer
+    than the period, the query times that were missed are skipped
+    (and counted in self.missed), rather than bunched up.
+
+    """
+    #: Number of recent queries to use for max_latency.
+    latency_history = 100
+
+    def __init__(self, acu, dataset, period=0.1):
+        self.acu = acu
+        self.dataset = dataset
+        self.period = period
+        self.label = f'{dataset} @{1/period:g} Hz'
+        self.latency = None
+        self.latencies = collections.deque(maxlen=self.latency_history)
+        self.dropped = 0
+        self.missed = 0
+        self.error = None
+        self._slot = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def max_latency(self):
+        return max(self.latencies, default=None)
+
+    def quantize_future(self, t):
+        # Returns t1, such that t1 > t and t1 - floor(t) is an integer
+        # multiple of self.period.
+        frac = (t % 1 + self.period) // self.period
+        return t // 1 + frac * self.period
+
+    def _run(self):
+        next_query_t = self.quantize_future(time.time())
+        while not self._stop.wait(max(0, next_query_t - time.time())):
+            t0 = time.time()
+            try:
+                v = self.acu.Values(self.dataset)
+            except Exception as e:
+                self.error = f'{e.__class__.__name__}: {e}'
+                v = None
             else:
-                self.fout.write(',\n')
-            self.fout.write(json.dumps(data))
-            self.n += 1
-        
+                self.error = None
+            self.latency = time.time() - t0
+            self.latencies.append(self.latency)
+            if v is not None:
+                with self._lock:
+                    if self._slot is not None:
+                        self.dropped += 1
+                    self._slot = (t0, v)
+            next_query_t += self.period
+            now = time.time()
+            if now > next_query_t:
+                later = self.quantize_future(now)
+                self.missed += round((later - next_query_t) / self.period)
+                next_query_t = later
+
+    def get(self):
+        """Returns the latest (query time, data), or None if there
+        hasn't been a new result since the last call."""
+        with self._lock:
+            item, self._slot = self._slot, None
+        return item
+
+    def status(self):
+        """Returns a one-line summary of the polling performance."""
+        if self.latency is None:
+            return 'waiting for first poll'
+        text = (f'poll {self.latency*1e3:6.1f} ms '
+                f'(max {self.max_latency*1e3:6.1f}) '
+                f'dropped {self.dropped} missed {self.missed}')
+        if self.error:
+            text += ' | ' + self.error
+        return text
+
+
+class StreamListener:
+    """Receive a broadcast stream (e.g. PositionBroadcast) in a
+    background thread, and decode it with the stream schema.  Like
+    Poller, this leaves a snapshot in a single slot for the UI to
+    take with get(), at most once per period; the snapshot holds the
+    fields of the latest sample, plus some derived items:
+
+    - 'ctime*': the sample time, as a unix timestamp.
+    - 'rate*': the sample rate (Hz), averaged over about 1 s.
+    - 'lost*', 'duplicated*', 'out-of-order*': sample counts from
+      soaculib.streams.StreamHealth.
+    - 'jitter*': standard deviation of the sample spacing, over about
+      1 s.
+    - 'latency*': local time of receipt minus the sample time.
+
+    The UI never touches the socket, so it never waits on it.
+
+    """
+    def __init__(self, name, stream, period=0.1):
+        self.dataset = name
+        self.period = period
+        self.schema = stream.schema
+        self.address = (stream.p['Destination'], int(stream.p['Port']))
+        self.label = f'stream {name} ({self.address[0]}:{self.address[1]})'
+        self.error = None
+        self.dropped = 0
+        self.packets = 0
+        self.samples = 0
+        self.lost = 0
+        self.rate = None
+        self.latency = None
+        self._slot = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        if self.schema is None:
+            self.error = 'no schema configured'
+            return
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind(self.address)
+        except OSError as e:
+            self.error = f'{e.__class__.__name__}: {e}'
+            return
+        sock.settimeout(0.2)
+        schema = self.schema
+        i_day, i_time = schema.index.get('Day'), schema.index.get('Time')
+        health = None
+        if i_day is not None and i_time is not None:
+            health = soaculib.streams.StreamHealth(schema)
+        frame_size = None
+        mark_t, mark_samples = time.time(), 0
+        jitter = None
+        next_snapshot = 0
+        with sock:
+            while not self._stop.is_set():
+                try:
+                    data_bytes = sock.recv(65536)
+                except socket.timeout:
+                    self.rate = 0.
+                    continue
+                now = time.time()
+                if len(data_bytes) != frame_size:
+                    frame_size = len(data_bytes)
+                    n, self.error = schema.check_datagram(frame_size)
+                if self.error is not None:
+                    continue
+                samples = schema.unpack(data_bytes)
+                self.packets += 1
+                self.samples += len(samples)
+                data = dict(zip(schema.fields, samples[-1]))
+                if health is not None:
+                    health.add_datagram(data_bytes, now)
+                    self.lost = health.dropped
+                    self.latency = health.last_offset
+                    data['ctime*'] = (None if self.latency is None
+                                      else '%.6f' % (now - self.latency))
+                    data['duplicated*'] = health.duplicated
+                    data['out-of-order*'] = health.out_of_order
+                if now - mark_t >= 1.:
+                    self.rate = (self.samples - mark_samples) / (now - mark_t)
+                    mark_t, mark_samples = now, self.samples
+                    if health is not None:
+                        jitter = health.report()['jitter']
+                # (The display layout is set by the first snapshot, so
+                # all the keys must be present from the start.)
+                data['jitter*'] = (None if jitter is None
+                                   else '%.3f ms' % (jitter * 1e3))
+                if now < next_snapshot:
+                    continue
+                next_snapshot = now + self.period
+                data['rate*'] = (None if self.rate is None
+                                 else '%.1f' % self.rate)
+                data['lost*'] = self.lost
+                data['latency*'] = (None if self.latency is None
+                                    else '%.1f ms' % (self.latency * 1e3))
+                with self._lock:
+                    if self._slot is not None:
+                        self.dropped += 1
+                    self._slot = (now, data)
+
+    def get(self):
+        """Returns the latest (receipt time, data), or None if there
+        hasn't been a new snapshot since the last call."""
+        with self._lock:
+            item, self._slot = self._slot, None
+        return item
+
+    def status(self):
+        """Returns a one-line summary of the stream reception."""
+        if self.error is not None:
+            return self.error
+        if self.rate is None:
+            return 'waiting for data'
+        text = (f'{self.rate:6.1f} samples/s, {self.packets} packets, '
+                f'lost {self.lost}')
+        if self.latency is not None:
+            text += f', latency {self.latency*1e3:.1f} ms'
+        return text
+
 
 def time_code(t, fmt='upload'):
     if fmt == 'upload':
@@ -137,103 +488,229 @@ def enrich(d, rec=None):
         t = calendar.timegm(time.strptime('%i' % d['Year'], '%Y')) + 86400 * (d['Time'] - 1)
         d['ctime*'] = '%.6f' % t
         d['human-time*'] = time.strftime('%Y-%m-%d %H:%M:%%07.4f', time.gmtime(t)) % (t%60.)
-    if rec is not None and rec.filename is not None:
+    if rec is not None and rec.error is not None:
+        d['recording*'] = 'failed: %s' % rec.error
+    elif rec is not None and rec.filename is not None:
         d['recording*'] = '+%s' % rec.filename
     else:
         d['recording*'] = 'no (r to start)'
     return d
 
 
-def headsup(stdscr, acu, dataset='DataSets.StatusSATPDetailed8100'):
+class Pane:
+    """One dataset in the headsup display: its Poller (or
+    StreamListener), and a Renderer for its region of the screen (a
+    title line, with the poll status, and the table below it).
+
+    """
+    def __init__(self, poller):
+        self.poller = poller
+        self.data = None
+        self.R = None
+        self.win = None
+        self.title = None
+
+    def place(self, stdscr, top, height, width):
+        """Assign the screen region, and redraw the last data (if
+        any) there."""
+        self.stdscr = stdscr
+        self.top = top
+        self.width = width
+        self.win = stdscr.derwin(height - 1, width, top + 1, 0)
+        self.R = Renderer(height, width)
+        self.title = None
+        if self.data is not None:
+            self.R.render(self.win, self.data)
+
+    def update(self, rec, focused):
+        """Render new data (or the old data, if the view has changed),
+        and the title line if it has changed.  Returns True if
+        anything was drawn.
+
+        """
+        drawn = False
+        item = self.poller.get()
+        if item is not None:
+            t, v = item
+            self.data = enrich(v, rec=rec)
+            rec.save_block(self.data, dataset=self.poller.dataset, t=t)
+        if self.data is not None and (item is not None
+                                      or self.R.slots is None):
+            # New data, or the view has changed.
+            self.R.render(self.win, self.data)
+            drawn = True
+        text = (f'{"*" if focused else " "} {self.poller.label} | '
+                f'{self.poller.status()}')
+        text = text[:self.width - 1].ljust(self.width - 1)
+        if text != self.title:
+            self.title = text
+            self.stdscr.addstr(self.top, 0, text, curses.A_REVERSE)
+            self.stdscr.noutrefresh()
+            drawn = True
+        return drawn
+
+
+def layout(stdscr, panes):
+    """Stack the panes down the screen, keeping the bottom line for
+    key help."""
+    stdscr.erase()
+    rows, cols = stdscr.getmaxyx()
+    base = (rows - 1) // len(panes)
+    for i, pane in enumerate(panes):
+        height = base if i < len(panes) - 1 else rows - 1 - i * base
+        pane.place(stdscr, i * base, height, cols)
+    help_text = (' Tab: next pane  Up/Dn/PgUp/PgDn/Home/End: scroll  '
+                 '+/-: width  r: record  q: quit')
+    stdscr.addstr(rows - 1, 0, help_text[:cols - 1], curses.A_DIM)
+    stdscr.noutrefresh()
+
+
+#: Default Recorder arguments; the filename is passed through
+#: time.strftime when recording starts.
+RECORD_ARGS = {
+    'filename': 'acu-headsup-%Y%m%d-%H%M%S.ndjson',
+    'fsync_period': 5.,
+    'max_bytes': 100 * 2**20,
+}
+
+
+def headsup(stdscr, acu, datasets=[('DataSets.StatusSATPDetailed8100', 10.)],
+            record_args=None, record=False, streams=[]):
+    """Monitor one or more datasets, each in its own pane.  The
+    datasets argument is a list of (dataset, query rate in Hz).  All
+    queries go through acu, from one Poller thread per dataset, so
+    the backend should be persistent and have a connection pool at
+    least as large as the number of datasets.
+
+    Broadcast streams named in streams (see acu.streams) are shown in
+    panes too, after the datasets; see StreamListener.
+
+    Recording (of all datasets) is toggled with the 'r' key, or
+    started straight away if record.  The record_args are passed to
+    Recorder, with defaults from RECORD_ARGS.
+
+    """
+    def start_recording():
+        args = dict(RECORD_ARGS, **(record_args or {}))
+        args['filename'] = time.strftime(args['filename'])
+        return Recorder(**args)
+
     curses.noecho()
     curses.cbreak()
     stdscr.keypad(True)
     stdscr.nodelay(True)
 
-    # Limit queries to 10 Hz.
-    min_query_period = 0.1
-
-    def quantize_future(t):
-        # Returns t1, such that t1 > t and t1 - floor(t) is an integer
-        # multiple of min_query_period.
-        frac = (t % 1 + min_query_period) // min_query_period
-        return t // 1 + frac * min_query_period
-
-    next_query_t = quantize_future(time.time())
+    panes = [Pane(Poller(acu, dataset, period=1./rate).start())
+             for dataset, rate in datasets]
+    panes.extend([Pane(StreamListener(name, acu.streams[name]).start())
+                  for name in streams])
+    focus = 0
 
     stdscr.addstr(1,1, 'Loading acu-headsup ...')
-    w = stdscr
+    stdscr.refresh()
+    layout(stdscr, panes)
     running = True
-    R = None
-    rec = Recorder()
-    while running:
-        now = time.time()
-        if now >= next_query_t:
-            v = acu.Values(dataset)
-            if R is None:
-                R = Renderer(*stdscr.getmaxyx())
-            data = enrich(v, rec=rec)
-            R.render(stdscr, data)
-            rec.save_block(data)
-            next_query_t += min_query_period
-            if now > next_query_t:
-                next_query_t = quantize_future(now)
-        stdscr.refresh()
-        while True:
-            c = stdscr.getch()
-            if c == -1:
-                time.sleep(0.01)
-                break
-            if c == curses.KEY_RESIZE:
-                R = None
-            elif c in [ord('r'), ord('R')]:
-                if rec.fout is None:
-                    rec = Recorder('/home/simons/code/vertex-acu-agent/hacking/data/track_feb25_new.txt')
-                else:
-                    rec = Recorder()
-            elif c in [ord('q'), 27]:
-                running = False
-            elif c == curses.KEY_UP:
-                R.update_view(-1)
-            elif c == curses.KEY_DOWN:
-                R.update_view(1)
-            elif c == curses.KEY_PPAGE:
-                R.update_view(page=-1)
-            elif c == curses.KEY_NPAGE:
-                R.update_view(page=1)
-            elif c == ord('+'):
-                R.update_view(width=4)
-            elif c == ord('-'):
-                R.update_view(width=-4)
-            elif c == curses.KEY_HOME:
-                R.update_view(home=True)
-            elif c == curses.KEY_END:
-                R.update_view(end=True)
-            elif c== ord('.'):
-                R.update_view(truncate=not R.truncate)
+    rec = start_recording() if record else Recorder()
+    try:
+        while running:
+            # The screen is only updated here, at most once per poll; view
+            # changes from keys pressed since are picked up too.
+            update = False
+            for i, pane in enumerate(panes):
+                update = pane.update(rec, i == focus) or update
+            if update:
+                curses.doupdate()
+            R = panes[focus].R
+            while True:
+                c = stdscr.getch()
+                if c == -1:
+                    time.sleep(0.01)
+                    break
+                if c == curses.KEY_RESIZE:
+                    layout(stdscr, panes)
+                    R = panes[focus].R
+                elif c == ord('\t'):
+                    focus = (focus + 1) % len(panes)
+                    R = panes[focus].R
+                elif c in [ord('r'), ord('R')]:
+                    if rec.filename is None:
+                        rec = start_recording()
+                    else:
+                        rec.close()
+                        rec = Recorder()
+                elif c in [ord('q'), 27]:
+                    running = False
+                elif c == curses.KEY_UP:
+                    R.update_view(-1)
+                elif c == curses.KEY_DOWN:
+                    R.update_view(1)
+                elif c == curses.KEY_PPAGE:
+                    R.update_view(page=-1)
+                elif c == curses.KEY_NPAGE:
+                    R.update_view(page=1)
+                elif c == ord('+'):
+                    R.update_view(width=4)
+                elif c == ord('-'):
+                    R.update_view(width=-4)
+                elif c == curses.KEY_HOME:
+                    R.update_view(home=True)
+                elif c == curses.KEY_END:
+                    R.update_view(end=True)
+                elif c== ord('.'):
+                    R.update_view(truncate=not R.truncate)
+    finally:
+        for pane in panes:
+            pane.poller.stop()
+        rec.close()
 
 
 def get_parser():
     from argparse import ArgumentParser
     parser = ArgumentParser(usage=USAGE)
 #    parser.add_argument('-d', '--dataset', default='DataSets.StatusSATPDetailed8100', help='Dataset to monitor')
-    parser.add_argument('-d', '--dataset', default='DataSets.StatusGeneral8100', help='Dataset to monitor')
+    parser.add_argument('-d', '--dataset', action='append', help=
+                        "Dataset to monitor (full or short name), "
+                        "optionally with a query rate, as NAME@HZ.  Pass "
+                        "more than once to monitor several datasets, each "
+                        "in its own pane.  Pass 'list' to list the short "
+                        "names.  Defaults to DataSets.StatusGeneral8100.")
+    parser.add_argument('-s', '--stream', action='append', default=[], help=
+                        "Broadcast stream to monitor (e.g. 'main'), in its "
+                        "own pane; pass more than once for several streams, "
+                        "or 'all' for all active streams in the config.")
+    parser.add_argument('-r', '--rate', type=float, default=10., help=
+                        "Default query rate (Hz).")
     parser.add_argument('-c', '--config', default='guess', help=
                         "Config block to use.")
+    parser.add_argument('-o', '--output', default=RECORD_ARGS['filename'],
+                        help="File to record to (press 'r' to start and stop "
+                        "recording); may include strftime codes.  Records "
+                        "are written as newline-delimited JSON.")
+    parser.add_argument('--record', action='store_true', help=
+                        "Start recording straight away.")
+    parser.add_argument('--rotate-mb', type=float,
+                        default=RECORD_ARGS['max_bytes'] / 2**20, help=
+                        "Start a new recording file once the current one "
+                        "reaches this size (MB); 0 to disable.")
+    parser.add_argument('--fsync', type=float,
+                        default=RECORD_ARGS['fsync_period'], help=
+                        "Period (s) at which to flush the recording to disk.")
     return parser
 
 
 def main(args=None):
+    parser = get_parser()
     if args is None:
-        parser = get_parser()
         args = parser.parse_args()
-    args = parser.parse_args()
+    if args.dataset is None:
+        args.dataset = [] if args.stream else ['DataSets.StatusGeneral8100']
 
-    acu = soaculib.AcuControl(args.config, persistent=True, readonly=True)
+    config = soaculib.guess_config(args.config)
 
-    if not args.dataset.lower().startswith('datasets.'):
+    dataset_opts = {}
+    if not all([d.lower().startswith('datasets.') for d in args.dataset]):
         # Look it up ...
-        platform = acu._config.get('platform')
+        platform = config.get('platform')
         if platform is None:
             parser.error('ACU configuration does not specify a "platform".')
         if not isinstance(platform, dict):
@@ -243,15 +720,50 @@ def main(args=None):
                          f'platform "{platform}".')
 
         dataset_opts = {short: full_name for short, full_name in cfg['datasets']}
-        if args.dataset == 'list':
+        if 'list' in args.dataset:
             print('Datasets:')
             for k, v in dataset_opts.items():
                 print(f'  {k:<20} : {v}')
             parser.exit(1)
-        else:
-            args.dataset = dataset_opts[args.dataset]
 
-    curses.wrapper(headsup, acu, args.dataset)
+    datasets = []
+    for d in args.dataset:
+        name, rate = d, args.rate
+        if '@' in d:
+            name, rate = d.rsplit('@', 1)
+            try:
+                rate = float(rate)
+            except ValueError:
+                parser.error(f'Invalid query rate in "{d}".')
+        if rate <= 0:
+            parser.error(f'Invalid query rate in "{d}".')
+        if name in dataset_opts:
+            name = dataset_opts[name]
+        elif not name.lower().startswith('datasets.'):
+            parser.error(f'Unknown dataset "{name}"; use "-d list" to see '
+                         'the short names, or give the full name '
+                         '(DataSets.*).')
+        datasets.append((name, rate))
+
+    # One persistent session, with a connection for each dataset.
+    backend = soaculib.get_backend(
+        persistent=True,
+        pool_size=max(len(datasets), config.get('http_pool_size') or 0))
+    acu = soaculib.AcuControl(config, backend=backend, readonly=True)
+
+    if 'all' in args.stream:
+        args.stream = list(acu.streams)
+    for name in args.stream:
+        if name not in acu.streams:
+            parser.error(f'No stream "{name}" found in ACU config.')
+
+    record_args = {
+        'filename': args.output,
+        'fsync_period': args.fsync,
+        'max_bytes': int(args.rotate_mb * 2**20) or None,
+    }
+    curses.wrapper(headsup, acu, datasets, record_args=record_args,
+                   record=args.record, streams=args.stream)
 
 if __name__ == '__main__':
     main()
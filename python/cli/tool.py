@@ -7,10 +7,15 @@ datasets, and querying version information.
 """
 
 import argparse
+import csv
+import functools
+import json
+import math
 import requests
 import socket
 import struct
 import subprocess
+import sys
 import time
 import urllib
 import yaml
@@ -56,6 +61,17 @@ def get_parser():
     p.add_argument('-e', '--enable', action='store_true', help="Enable the stream, too.")
     p.add_argument('-o', '--output', help=
                    "Record the stream to file.")
+    p = subparsers.add_parser('health-bcast', help=
+                              "Monitor the health of the PositionBroadcast "
+                              "stream(s): dropped, duplicated and out-of-order "
+                              "samples, jitter, and clock offset.",
+                              parents=[bcast_p])
+    p.add_argument('-e', '--enable', action='store_true', help="Enable the stream, too.")
+    p.add_argument('-i', '--interval', type=float, default=10., help=
+                   "Report interval (s).")
+    p.add_argument('--period', type=float, default=None, help=
+                   "Nominal sample period (s); estimated from the data "
+                   "if not specified.")
 
     p = subparsers.add_parser('meta', help=
                               "Query the Meta plugin.  Prints a huge XML tree.")
@@ -81,12 +97,164 @@ def get_parser():
     p.add_argument('--reconcile', action='store_true',
                    help="Verify the mapping between fields found in dataset "
                    "and fields enumerated internally for reporting.")
+    p.add_argument('--follow', action='store_true',
+                   help="Query the dataset(s) continuously, writing a "
+                   "timestamped row per query; the columns are fixed by "
+                   "the first query.")
+    p.add_argument('--rate', type=float, default=10.,
+                   help="Query rate (Hz) for --follow.")
+    p.add_argument('--format', default='ndjson',
+                   choices=['ndjson', 'csv', 'binary'],
+                   help="Output format for --follow.  The binary format is "
+                   "a line of JSON giving the struct format and fields of "
+                   "each record (as in stream_schemas), followed by the "
+                   "records; only numeric and boolean columns are included.")
+    p.add_argument('-o', '--output', default=None,
+                   help="File to write to, for --follow (default stdout).")
 
     p = subparsers.add_parser('stop', help="Stop all axes.")
 
     return parser
 
 
+class _SizedDecoder(aculib.http.HttpDecoder):
+    """Decoder that returns (decoded result, response body size)."""
+    def __call__(self, resp_code, text):
+        return super().__call__(resp_code, text), len(text)
+
+
+def query_datasets(acu, names):
+    """Query the Values of several datasets concurrently (over the
+    backend's connection pool).  Returns a list with (data, size of
+    response in bytes, latency in s, error) for each dataset; error is
+    None on success, and otherwise data and size are None.
+
+    """
+    def query(name):
+        req = aculib.http.HttpRequest(
+            'GET', acu.http.base_url + '/Values',
+            {'identifier': name, 'type': 'Actual', 'format': 'JSON'},
+            decoder=_SizedDecoder('json'))
+        t0 = time.time()
+        try:
+            data, size = next(acu.http.backend(req))
+        except Exception as e:
+            return None, None, time.time() - t0, e
+        return data, size, time.time() - t0, None
+    return next(acu.http.backend.gather(
+        [functools.partial(query, n) for n in names]))
+
+
+class FollowWriter:
+    """Write rows of dataset samples, for dataset --follow.  The
+    columns are fixed by the first row; fields missing from later
+    rows are written as null (or NaN, in binary), and new fields are
+    dropped.
+
+    """
+    def __init__(self, fout, fmt):
+        self.fout = fout
+        self.fmt = fmt
+        self.columns = None
+
+    def _start(self, row):
+        self.columns = list(row.keys())
+        if self.fmt == 'csv':
+            self.csv = csv.writer(self.fout)
+            self.csv.writerow(self.columns)
+        elif self.fmt == 'binary':
+            # Only numbers and booleans; ints are stored as doubles, in
+            # case the type varies.
+            codes = {}
+            for k, v in row.items():
+                if isinstance(v, bool):
+                    codes[k] = '?'
+                elif isinstance(v, (int, float)):
+                    codes[k] = 'd'
+            self.columns = list(codes.keys())
+            self.codes = [codes[k] for k in self.columns]
+            self.struct = struct.Struct('<' + ''.join(self.codes))
+            header = {'format': self.struct.format, 'fields': self.columns}
+            self.fout.write(json.dumps(header).encode('utf-8') + b'\n')
+
+    def write(self, row):
+        if self.columns is None:
+            self._start(row)
+        values = [row.get(k) for k in self.columns]
+        if self.fmt == 'ndjson':
+            self.fout.write(json.dumps(dict(zip(self.columns, values))) + '\n')
+        elif self.fmt == 'csv':
+            self.csv.writerow(['' if v is None else v for v in values])
+        else:
+            packed = []
+            for c, v in zip(self.codes, values):
+                if c == '?':
+                    packed.append(bool(v))
+                else:
+                    try:
+                        packed.append(float(v))
+                    except (TypeError, ValueError):
+                        packed.append(math.nan)
+            self.fout.write(self.struct.pack(*packed))
+        self.fout.flush()
+
+
+def follow_datasets(acu, names, labels, rate, writer):
+    """Query the datasets together at the given rate (Hz), and pass
+    each set of results to writer as a row, with the query 'time'
+    first.  If there's more than one dataset, the columns are labelled
+    '<label>:<field>'.  Query times that are missed because a query
+    ran long are skipped.
+
+    """
+    period = 1. / rate
+    next_t = time.time()
+    while True:
+        now = time.time()
+        if now < next_t:
+            time.sleep(next_t - now)
+        t = time.time()
+        row = {'time': t}
+        errors = []
+        for label, (data, size, latency, err) in zip(
+                labels, query_datasets(acu, names)):
+            if err is not None:
+                errors.append(f'{label}: {err}')
+                continue
+            if len(names) == 1:
+                row.update(data)
+            else:
+                row.update({f'{label}:{k}': v for k, v in data.items()})
+        if errors:
+            print('# error at %.6f: %s' % (t, '; '.join(errors)),
+                  file=sys.stderr)
+        else:
+            writer.write(row)
+        next_t += period
+        now = time.time()
+        if now > next_t:
+            next_t += ((now - next_t) // period + 1) * period
+
+
+def format_health(name, report):
+    """Format a StreamHealth report for printing."""
+    def ms(x):
+        return 'n/a' if x is None else '%.3f' % (x * 1e3)
+    rate = 'n/a' if report['rate'] is None else '%.2f' % report['rate']
+    return '\n'.join([
+        f'{name}: rate={rate} samples={report["samples"]} '
+        f'packets={report["packets"]} dropped={report["dropped"]} '
+        f'duplicated={report["duplicated"]} '
+        f'out_of_order={report["out_of_order"]} '
+        f'restarts={report["restarts"]} bad_size={report["bad_size"]}',
+        f'  interval (ms): period={ms(report["period"])} '
+        f'mean={ms(report["interval_mean"])} jitter={ms(report["jitter"])} '
+        f'min={ms(report["interval_min"])} max={ms(report["interval_max"])}',
+        f'  host - ACU time (ms): min={ms(report["offset_min"])} '
+        f'mean={ms(report["offset_mean"])} max={ms(report["offset_max"])}',
+    ])
+
+
 def main(args=None):
     if args is None:
         parser = get_parser()
@@ -146,42 +314,50 @@ def main(args=None):
         if is_all_streams:
             print('Here is a summary of the %i known streams:\n' %
                   len(target_streams))
+        statuses = acu.streams.get_status(list(target_streams))
         for name, stream in target_streams.items():
             print(f"  stream:        '{name}' @{stream.p['module']}")
-            cfg, raw = stream.get_status()
+            cfg, raw = statuses[name]
             print(f"    target_ok:   {cfg['target_ok']}")
             print(f"    enabled:     {cfg['enabled']}")
             print()
 
     elif args.command == 'enable-bcast':
         is_all_streams, target_streams = get_target_streams()
+        print(f"  enabling streams: {', '.join(target_streams)}")
+        statuses = acu.streams.safe_enable(list(target_streams))
         for name, stream in target_streams.items():
             print(f"  stream:        '{name}' @{stream.p['module']}")
-            print(f"    enabling stream")
-            cfg, raw = stream.safe_enable()
+            cfg, raw = statuses[name]
             if not cfg['enabled'] or not cfg['target_ok']:
                 print(f"    -- stream not successfully enabled!")
 
     elif args.command == 'disable-bcast':
         is_all_streams, target_streams = get_target_streams()
+        statuses = acu.streams.get_status(list(target_streams))
+        to_disable = []
         for name, stream in target_streams.items():
             print(f"  stream:        '{name}' @{stream.p['module']}")
-            cfg, raw = stream.get_status()
+            cfg, raw = statuses[name]
             if cfg['enabled'] or args.force:
                 print("    disabling...")
-                stream.disable()
+                to_disable.append(name)
             else:
                 print("    stream already disabled, no action.")
+        if to_disable:
+            acu.streams.disable(to_disable)
 
-    elif args.command == 'listen-bcast':
+    elif args.command in ['listen-bcast', 'health-bcast']:
         socks = {}
         report_interval = 1.
         socket_timeout = 0.3
+        health = (args.command == 'health-bcast')
 
         is_all_streams, target_streams = get_target_streams()
+        statuses = acu.streams.get_status(list(target_streams))
         for name, stream in target_streams.items():
             print(f"  stream:        '{name}' @{stream.p['module']}")
-            cfg, raw = stream.get_status()
+            cfg, raw = statuses[name]
             print(f"    target_ok:   {cfg['target_ok']}")
             print(f"    enabled:     {cfg['enabled']}")
             if not cfg['target_ok'] or not cfg['enabled']:
@@ -194,10 +370,18 @@ def main(args=None):
                     print("    -- note you can pass --enable to re-configure "
                           "       and enable the stream now.")
             print()
-            raw['schema'] = stream.p['schema']
+            raw['schema'] = stream.schema
+            raw['frame_size'] = None
+            raw['samples'] = None
+            if health:
+                if stream.schema is None:
+                    parser.error(f'No schema configured for stream "{name}".')
+                raw['health'] = aculib.streams.StreamHealth(
+                    stream.schema, sample_period=args.period)
+                raw['health_time'] = time.time()
             socks[name] = raw
 
-        if args.output:
+        if not health and args.output:
             if len(target_streams) != 1:
                 parser.error("Pick a single stream with -s to output.")
             print('Saving stream to %s' % args.output)
@@ -229,6 +413,23 @@ def main(args=None):
                 if len(data) and s.get('fout'):
                     s['fout'].write(data)
 
+                # Check the datagram size against the schema when the
+                # stream starts (or the size changes).
+                if len(data) != s['frame_size']:
+                    s['frame_size'] = len(data)
+                    if s['schema'] is not None:
+                        s['samples'], err = s['schema'].check_datagram(len(data))
+                        if err:
+                            print(f'{name}:  -- {err}!')
+
+                if health:
+                    s['health'].add_datagram(data, time.time())
+                    if now - s['health_time'] >= args.interval:
+                        s['health_time'] = now
+                        print(format_health(name, s['health'].report()))
+                        print()
+                    continue
+
                 if not 'mark_time' in s:
                     s['mark_time'] = now
                     s['mark_bytes'] = 0
@@ -246,20 +447,16 @@ def main(args=None):
                 frame_rate = s['mark_frames'] / (now - s['mark_time'])
                 del s['mark_time']
 
-                frame_size = len(data)
-                bytes_per_sample = frame_size / 10
-
-                print(f'{name}: frame_rate={frame_rate:.3f}, data_rate={byte_rate:.3f}, '
-                      f'frame_size={frame_size} '
-                      f'({bytes_per_sample:.1f} bytes per sample)')
+                text = (f'{name}: frame_rate={frame_rate:.3f}, data_rate={byte_rate:.3f}, '
+                        f'frame_size={s["frame_size"]}')
+                if s['samples']:
+                    text += (f' ({s["samples"]} samples of {s["schema"].size} '
+                             f'bytes)')
+                print(text)
 
-                if s['schema'] is not None:
-                    fmt = s['schema']['format']
-                    n = struct.calcsize(fmt)
-                    if n != bytes_per_sample:
-                        print(f'  -- schema struct size mismatch ({n} vs {bytes_per_sample})!')
-                    vals = struct.unpack(fmt, data[-n:])
-                    for f, v in zip(s['schema']['fields'], vals):
+                if s['samples']:
+                    vals = s['schema'].unpack_last(data)
+                    for f, v in zip(s['schema'].fields, vals):
                         print(f'  {f:<25}: {v}')
                 print()
 
@@ -286,33 +483,76 @@ def main(args=None):
                 parser.error(f'The loaded config does not list datasets for platform "{platform}".')
 
         dataset_opts = {short: full_name for short, full_name in cfg['datasets']}
-        if args.list:
+        if len(args.datasets) == 0:
+            args.datasets = [cfg['default_dataset']]
+
+        # All the datasets are requested at once, over a persistent
+        # connection pool with room for all of them.
+        n_queries = len(dataset_opts) if args.list else len(args.datasets)
+        acu = aculib.AcuControl(
+            acu._config, readonly=args.readonly,
+            backend=aculib.get_backend(persistent=True, pool_size=max(
+                n_queries, acu._config.get('http_pool_size') or 0)))
+
+        if args.follow:
+            if args.rate <= 0:
+                parser.error('The --rate must be positive.')
+            names = [dataset_opts.get(n, n) for n in args.datasets]
+            binary = (args.format == 'binary')
+            if args.output is None:
+                fout = sys.stdout.buffer if binary else sys.stdout
+            elif binary:
+                fout = open(args.output, 'wb')
+            else:
+                fout = open(args.output, 'w', newline='')
+            try:
+                follow_datasets(acu, names, args.datasets, args.rate,
+                                FollowWriter(fout, args.format))
+            except (KeyboardInterrupt, BrokenPipeError):
+                pass
+            finally:
+                if args.output is not None:
+                    fout.close()
+        elif args.list:
+            results = [None] * len(dataset_opts)
+            if args.check:
+                results = query_datasets(acu, list(dataset_opts.values()))
             print('Known datasets:')
-            for short, full_name in dataset_opts.items():
+            for (short, full_name), result in zip(dataset_opts.items(), results):
                 print('  %-20s: %s' % (short, full_name))
-                if args.check:
-                    try:
-                        data = acu.Values(full_name)
-                    except aculib.http.HttpError as e:
-                        print('    error requesting dataset "%s"!' % full_name)
-                        continue
-                    print('    loaded values for %i items' % len(data))
+                if result is None:
+                    continue
+                data, size, latency, err = result
+                if err is not None:
+                    print('    error requesting dataset "%s"! (%s)' % (full_name, err))
+                    continue
+                print('    loaded values for %i items (%i bytes in %.1f ms)'
+                      % (len(data), size, latency * 1e3))
             print()
+            if args.check:
+                print('Datasets by response size:')
+                print('  %10s %10s  %s' % ('bytes', 'ms', 'dataset'))
+                for full_name, (data, size, latency, err) in sorted(
+                        zip(dataset_opts.values(), results),
+                        key=lambda x: -(x[1][1] or 0)):
+                    if err is None:
+                        print('  %10i %10.1f  %s' % (size, latency * 1e3, full_name))
+                print()
         else:
-            if len(args.datasets) == 0:
-                args.datasets = [cfg['default_dataset']]
-            for n in args.datasets:
-                n = dataset_opts.get(n, n)
-                try:
-                    t = acu.Values(n)
-                except aculib.http.HttpError as e:
+            names = [dataset_opts.get(n, n) for n in args.datasets]
+            if args.reconcile:
+                # Map from dataset field to internal name; built once.
+                reconcile_map = {}
+                for group, items in status_fields[platform]['status_fields'].items():
+                    for field, alias in items.items():
+                        reconcile_map[field] = f'{group}.{alias}'
+            for n, (t, size, latency, err) in zip(
+                    names, query_datasets(acu, names)):
+                if err is not None:
                     print('#  error requesting dataset "%s"!' % n)
                     continue
                 if args.reconcile:
-                    internal_map = {}
-                    for group, items in status_fields[platform]['status_fields'].items():
-                        for field, alias in items.items():
-                            internal_map[field] = f'{group}.{alias}'
+                    internal_map = dict(reconcile_map)
                     print('Items not found in internal map:')
                     for k, v in t.items():
                         if internal_map.pop(k, None) is None:
@@ -6,16 +6,64 @@ If you want the envvar, it's ACU_CONFIG.
 
 See acu-configs.yaml, in the package directory, for example syntax.
 
+Parsed files are kept in memory, and only re-read if their mtime or
+size changes; so calling load() and guess_config() repeatedly is
+cheap.  The stream_schemas are compiled once per parse, see
+get_stream_schema().
+
 """
 
+import functools
 import os
 import socket
+import struct
 import yaml
 
+try:
+    from yaml import CSafeLoader as _SafeLoader
+except ImportError:
+    from yaml import SafeLoader as _SafeLoader
+
 #: Global variable to hold the most-recent config block from calling
 #: load().
 cache = None
 
+#: The file that cache was loaded from.
+_cache_file = None
+
+#: Parsed config files; map from filename to ((mtime, size), config).
+_parsed = {}
+
+
+def _stat_key(filename):
+    """Return (mtime, size) for filename, or None if it doesn't
+    exist."""
+    try:
+        st = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _parse(filename, key):
+    """Parse and annotate a config file, or return the cached result
+    if the file hasn't changed since it was parsed."""
+    entry = _parsed.get(filename)
+    if entry is not None and entry[0] == key:
+        return entry[1]
+    with open(filename, 'rb') as f:
+        config = yaml.load(f, Loader=_SafeLoader)
+    # Annotate
+    for k, v in config.get('devices', {}).items():
+        v['_name'] = k
+        v['_filename'] = filename
+        v['_datasets'] = config.get('datasets', {}).get(v['platform'], {})
+    for k, v in config.get('stream_schemas', {}).items():
+        v['_name'] = k
+        v['_struct'] = struct.Struct(v['format'])
+    _parsed[filename] = (key, config)
+    return config
+
 def load(config_file=None, update_cache=True):
     """Load ACU configuration file and return the contents (as a dict).
     By default, this will also update (replace) the internal
@@ -31,8 +79,11 @@ def load(config_file=None, update_cache=True):
 
     If none of those exist, an exception is raised.
 
+    If the file has already been parsed, and has not changed since,
+    the same config dict is returned again.
+
     """
-    global cache
+    global cache, _cache_file
     things_to_try = [
         (config_file, True, 'user-specified file "{filename}"'),
         (os.getenv('ACU_CONFIG'), True, 'environment variable ACU_CONFIG="{filename}"'),
@@ -43,8 +94,9 @@ def load(config_file=None, update_cache=True):
     for filename, fail_on_missing, desc_format in things_to_try:
         if filename is None:
             continue
-        if os.path.exists(filename):
-            config = yaml.safe_load(open(filename, 'r').read())
+        key = _stat_key(filename)
+        if key is not None:
+            config = _parse(filename, key)
             break
         if fail_on_missing:
             raise RuntimeError("Config file not found; " +
@@ -52,18 +104,29 @@ def load(config_file=None, update_cache=True):
     else:
         raise RuntimeError("Could not find an ACU config file.  See docs "
                            "or try putting one in ~/.acu.yaml or /etc/acu.yaml.")
-    # Annotate
-    for k, v in config.get('devices', {}).items():
-        v['_name'] = k
-        v['_filename'] = filename
-        v['_datasets'] = config.get('datasets', {}).get(v['platform'], {})
-
-    # Process config...
     if update_cache:
         cache = config
+        _cache_file = filename
     return config
 
 
+def _refresh():
+    """Load the config if that hasn't been done yet, or re-load it if
+    the file has changed."""
+    global cache
+    if cache is None:
+        load()
+        return
+    key = _stat_key(_cache_file)
+    if key is not None:
+        cache = _parse(_cache_file, key)
+
+
+@functools.lru_cache()
+def _system_hostname():
+    return socket.gethostname()
+
+
 def guess_config(hostname):
     """Return an ACU config block.  The "hostname" argument can be any
     of:
@@ -78,31 +141,98 @@ def guess_config(hostname):
     then that will be returned if all else fails.
 
     """
-    if cache is None:
-        load()
+    _refresh()
+    if isinstance(hostname, dict):
+        return hostname
 
     devices = cache.get('devices', {})
 
-    if isinstance(hostname, dict):
-        return hostname
     if hostname == 'guess':
         if os.getenv('ACU_CONFIG_BLOCK') is not None:
             hostname = os.getenv('ACU_CONFIG_BLOCK')
         else:
-            hostname = socket.gethostname()
+            hostname = _system_hostname()
     if not hostname in devices:
         if '_default' in devices:
-            hostname = default
+            hostname = '_default'
         else:
             raise ValueError('No block for system "%s" (and no _default) in config!' % hostname)
     return devices[hostname]
 
 def get_stream_schema(name):
     """
-    Returns the stream_schemas entry for name.
+    Returns the stream_schemas entry for name.  In addition to
+    'format' and 'fields', the entry has '_name', and '_struct' (the
+    compiled struct.Struct for one sample).
     """
     return cache['stream_schemas'][name]
 
+
+#: numpy type kinds for struct format characters.
+_DTYPE_KINDS = {
+    'b': 'i', 'B': 'u', '?': 'b', 'h': 'i', 'H': 'u', 'i': 'i', 'I': 'u',
+    'l': 'i', 'L': 'u', 'q': 'i', 'Q': 'u', 'e': 'f', 'f': 'f', 'd': 'f',
+}
+
+
+def get_schema_dtype(schema):
+    """Returns the numpy dtype (a structured type, with one field per
+    schema field) for samples of a stream schema; schema may be a
+    stream_schemas entry or its name.  The dtype is computed on first
+    request and then stored in the entry as '_dtype'.  This requires
+    numpy.
+
+    """
+    if isinstance(schema, str):
+        schema = get_stream_schema(schema)
+    if '_dtype' in schema:
+        return schema['_dtype']
+    import numpy as np
+    fmt = schema['format']
+    order, aligned = '<', False
+    if fmt[:1] in '@=<>!':
+        order, fmt = fmt[0], fmt[1:]
+    if order == '@':
+        aligned = True
+    types = []
+    count = ''
+    for c in fmt:
+        if c.isdigit():
+            count += c
+            continue
+        n, count = int(count or 1), ''
+        if c == 'x':
+            types.extend([None] * n)
+            continue
+        if c not in _DTYPE_KINDS:
+            raise ValueError(f'Cannot convert format {schema["format"]!r} '
+                             f'to a dtype.')
+        t = '%s%s%i' % ({'!': '>', '@': '='}.get(order, order),
+                        _DTYPE_KINDS[c], struct.calcsize(order + c))
+        types.extend([t] * n)
+    fields = list(schema['fields'])
+    if len(fields) != len([t for t in types if t is not None]):
+        raise ValueError(f'Stream schema {schema.get("_name")} format '
+                         f'and fields do not match.')
+    # Pad bytes are left out, but the field offsets account for them.
+    names, formats, offsets, offset = [], [], [], 0
+    for t in types:
+        if t is None:
+            offset += 1
+            continue
+        dt = np.dtype(t)
+        if aligned:
+            offset += -offset % dt.alignment
+        names.append(fields.pop(0))
+        formats.append(dt)
+        offsets.append(offset)
+        offset += dt.itemsize
+    dtype = np.dtype({'names': names, 'formats': formats,
+                      'offsets': offsets,
+                      'itemsize': struct.calcsize(schema['format'])})
+    schema['_dtype'] = dtype
+    return dtype
+
 def get_datasets(platform):
     """
     Returns the datasets entry for the given platform.
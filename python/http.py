@@ -10,6 +10,60 @@ class HttpError(Exception):
     pass
 
 
+#: Command responses that indicate success.  Any response starting
+#: with 'OK' is treated as success.
+COMMAND_OK = ['OK, Command executed.', 'OK, Command send.']
+
+#: Known Command error responses (lower case), and what they mean.
+COMMAND_ERRORS = {
+    'identifier not found': 'unknown identifier',
+    'command not found': 'unknown command',
+}
+
+
+def command_ok(text):
+    """True if text (str or bytes) is a Command success response."""
+    if isinstance(text, bytes):
+        text = text.decode('utf-8', errors='replace')
+    return isinstance(text, str) and text.startswith('OK')
+
+
+class CommandError(HttpError):
+    """Raised when the ACU responds to a Command with anything other
+    than a success string.
+
+    Attributes:
+      identifier (str): The Command identifier (dataset).
+      command (str): The command name.
+      parameter (str): The parameter string, or None.
+      response (str): The response text.
+      reason (str): A short explanation, if the response is a known
+        error string (see COMMAND_ERRORS), otherwise None.
+
+    """
+    def __init__(self, identifier, command, parameter, response):
+        if isinstance(response, bytes):
+            response = response.decode('utf-8', errors='replace')
+        self.identifier = identifier
+        self.command = command
+        self.parameter = parameter
+        self.response = response
+        self.reason = COMMAND_ERRORS.get(response.strip().lower())
+        msg = f'{identifier} {command!r}'
+        if parameter is not None:
+            msg += f' ({parameter})'
+        msg += f' failed: {response!r}'
+        if self.reason is not None:
+            msg += f' [{self.reason}]'
+        super().__init__(msg)
+
+    @classmethod
+    def from_params(cls, params, response):
+        """Construct from the Command HTTP query parameters."""
+        return cls(params.get('identifier'), params.get('command'),
+                   params.get('parameter'), response)
+
+
 class HttpDecoder:
     """This class should be instantiated to provide the correct error
     checking and decoding mechanisms for some HttpRequest.  After
@@ -31,7 +85,7 @@ class HttpDecoder:
 
     If response type is "cmd", then the returned value is a boolean
     that will be true if the reponse body text is "OK, Command
-    executed."
+    executed."  (See also CommandDecoder.)
 
     Otherwise, the returned value is simply the HTTP response body
     text as a string.
@@ -53,6 +107,27 @@ class HttpDecoder:
             return text
 
 
+class CommandDecoder(HttpDecoder):
+    """Decoder for Command responses.  Returns the response text if it
+    is a success string (see command_ok), and raises CommandError
+    otherwise.
+
+    Args:
+      params (dict): The Command HTTP query parameters (identifier,
+        command, parameter), for the error.
+
+    """
+    def __init__(self, params):
+        super().__init__('text')
+        self.params = params
+
+    def __call__(self, resp_code, text):
+        text = super().__call__(resp_code, text)
+        if not command_ok(text):
+            raise CommandError.from_params(self.params, text)
+        return text
+
+
 class HttpRequest:
     """This class is a container for requests (such as GET or POST to
     specific URLs) that can be passed to specific backends.
@@ -6,7 +6,8 @@ import soaculib
 
 from twisted.internet import reactor, threads
 from twisted.internet.defer import (
-    inlineCallbacks, Deferred, returnValue)
+    inlineCallbacks, Deferred, returnValue,
+    gatherResults, maybeDeferred, FirstError)
 
 import requests
 
@@ -57,3 +58,17 @@ class RetwistedHttpBackend(soaculib._Backend):
         d = Deferred()
         reactor.callLater(delay, d.callback, None)
         yield d
+
+    @inlineCallbacks
+    def gather(self, funcs):
+        """Call each function in funcs (with no arguments), and return a
+        Deferred that fires with the list of results once all have
+        completed.  If any fail, the first failure is raised.
+
+        """
+        try:
+            results = yield gatherResults([maybeDeferred(f) for f in funcs],
+                                          consumeErrors=True)
+        except FirstError as e:
+            e.subFailure.raiseException()
+        return results
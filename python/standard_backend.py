@@ -1,20 +1,33 @@
 import soaculib
 
 import requests
+import requests.adapters
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 import types
 import time
 
 
 class StandardBackend(soaculib._Backend):
-    """HTTP backend that uses standard Python requests library."""
-    def __init__(self, persistent=False):
+    """HTTP backend that uses standard Python requests library.
+
+    If persistent, a requests.Session is used so that connections are
+    kept alive and reused; pool_size sets the maximum number of
+    connections kept per host (the requests default is 10).
+
+    """
+    def __init__(self, persistent=False, pool_size=None):
         self.decorator = unyielding_decorator
         self.api_decorator = api_decorator
+        self.passthrough_decorator = passthrough_decorator
         self.return_val_func = returnValue
         self.session = requests
         if persistent:
             self.session = requests.Session()
+            if pool_size is not None:
+                adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+                self.session.mount('http://', adapter)
+                self.session.mount('https://', adapter)
 
     def execute(self, req):
         if req.req_type == 'GET':
@@ -33,6 +46,20 @@ class StandardBackend(soaculib._Backend):
         time.sleep(delay)
         yield
 
+    def gather(self, funcs):
+        """Call each function in funcs (with no arguments) in a separate
+        thread, and yield the list of results once all have returned.
+        If any raise, the first such exception is re-raised.
+
+        """
+        if len(funcs) < 2:
+            results = [f() for f in funcs]
+        else:
+            with ThreadPoolExecutor(len(funcs)) as pool:
+                futures = [pool.submit(f) for f in funcs]
+                results = [f.result() for f in futures]
+        yield results
+
 
 class DebuggingBackend:
     def __call__(self, req):
@@ -53,6 +80,29 @@ def returnValue(x):
     raise _ReturnValue(x)
 
 
+def _drive(gen):
+    """Run generator gen to completion, feeding each yielded value back
+    in with send -- unless the value is itself a generator, in which
+    case the first value from that generator is sent instead.
+
+    Returns the generator's return value (or the value passed to
+    returnValue).  For generators that fall off the end (or return
+    None), the last value sent in is returned.
+
+    """
+    send = gen.send
+    val = None
+    while True:
+        try:
+            val = send(val)
+        except StopIteration as stop:
+            return val if stop.value is None else stop.value
+        except _ReturnValue as rv:
+            return rv.value
+        if type(val) is types.GeneratorType:
+            val = next(val)
+
+
 def unyielding_decorator(f):
     """Decorator analagous to Twisted's inlineCallbacks that turns a
     generator function that yields multiple values into a generator
@@ -64,22 +114,7 @@ def unyielding_decorator(f):
     """
     @wraps(f)
     def wrapped(*args, **kwargs):
-        gen = f(*args, **kwargs)
-        val = None
-        while True:
-            try:
-                # If the function has yielded a generator, it's the
-                # first value from that gen that we want to extract.
-                if isinstance(val, types.GeneratorType):
-                    val = next(val)
-                val = gen.send(val)
-            except StopIteration:
-                break
-            except _ReturnValue as rv:
-                val = rv.value
-                break
-        yield val
-        raise StopIteration
+        yield _drive(f(*args, **kwargs))
     return wrapped
 
 
@@ -91,19 +126,18 @@ def api_decorator(f):
     """
     @wraps(f)
     def wrapped(*args, **kwargs):
-        gen = f(*args, **kwargs)
-        val = None
-        while True:
-            try:
-                # If the function has yielded a generator, it's the
-                # first value from that gen that we want to extract.
-                if isinstance(val, types.GeneratorType):
-                    val = next(val)
-                val = gen.send(val)
-            except StopIteration:
-                break
-            except _ReturnValue as rv:
-                val = rv.value
-                break
-        return val
+        return _drive(f(*args, **kwargs))
+    return wrapped
+
+
+def passthrough_decorator(f):
+    """Decorator for functions, such as AcuHttpInterface.Values, that
+    return the generator from StandardBackend.execute; produces a
+    function that returns the decoded result directly.  This is used
+    in place of api_decorator for simple pass-through methods.
+
+    """
+    @wraps(f)
+    def wrapped(*args, **kwargs):
+        return next(f(*args, **kwargs))
     return wrapped
@@ -1,5 +1,353 @@
+import calendar
+import collections
+import functools
+import math
+import struct
+import time
+
 import soaculib
 
+
+class StreamSchema:
+    """A compiled stream schema (see stream_schemas in
+    acu-configs.yaml), for decoding broadcast datagrams.  Use
+    get_schema() to obtain these, so that each schema is only compiled
+    once.
+
+    A datagram holds some whole number of samples, each packed
+    according to the schema format.  Rather than assuming a fixed
+    number of samples per datagram, this is inferred from the datagram
+    size; see samples_per_datagram() and check_datagram().
+
+    Attributes:
+      name (str): The schema name (e.g. 'v2'), or None.
+      format (str): The struct format of one sample.
+      fields (list): The field names, in order.
+      index (dict): Map from field name to position in a sample.
+      struct (struct.Struct): Compiled format of one sample.
+      size (int): Size of one sample, in bytes.
+
+    """
+    def __init__(self, format, fields, name=None, struct_=None):
+        if struct_ is None:
+            struct_ = struct.Struct(format)
+        self.name = name
+        self.format = format
+        self.fields = list(fields)
+        self.index = {f: i for i, f in enumerate(self.fields)}
+        self.struct = struct_
+        self.size = struct_.size
+        if len(self.fields) != len(struct_.unpack(bytes(self.size))):
+            raise ValueError(f'Stream schema {name} format and fields '
+                             f'do not match.')
+        self._dtype = None
+
+    @classmethod
+    def from_config(cls, entry):
+        """Compile a stream_schemas entry (dict)."""
+        return cls(entry['format'], entry['fields'], name=entry.get('_name'),
+                   struct_=entry.get('_struct'))
+
+    @property
+    def dtype(self):
+        """The numpy structured dtype of one sample (requires
+        numpy)."""
+        if self._dtype is None:
+            self._dtype = soaculib.configs.get_schema_dtype(
+                {'format': self.format, 'fields': self.fields,
+                 '_name': self.name})
+        return self._dtype
+
+    def samples_per_datagram(self, nbytes):
+        """Return the number of samples in a datagram of nbytes, or
+        None if that isn't a whole number of samples."""
+        n, extra = divmod(nbytes, self.size)
+        if extra or not n:
+            return None
+        return n
+
+    def check_datagram(self, nbytes):
+        """Check a datagram size against the schema.  Returns (n,
+        message), where n is the number of samples (or None) and
+        message is None if the size is ok, or else describes the
+        mismatch."""
+        n = self.samples_per_datagram(nbytes)
+        if n is not None:
+            return n, None
+        return None, (f'datagram size {nbytes} is not a multiple of the '
+                      f'schema {self.name} sample size ({self.size} bytes)')
+
+    def unpack(self, data):
+        """Return a list of sample tuples from a datagram."""
+        return list(self.struct.iter_unpack(data))
+
+    def unpack_last(self, data):
+        """Return the last sample in a datagram, as a tuple."""
+        return self.struct.unpack_from(data, len(data) - self.size)
+
+    def decode(self, data):
+        """Return the samples in a datagram (or several concatenated
+        datagrams) as a numpy structured array (a view of data)."""
+        import numpy as np
+        return np.frombuffer(data, self.dtype)
+
+
+@functools.lru_cache()
+def _year_start(year):
+    return calendar.timegm((year, 1, 1, 0, 0, 0))
+
+
+def sample_time(day, time_of_day, now=None):
+    """Convert the Day (day of year, starting from 1) and Time (seconds
+    since midnight UTC) of a stream sample to a unix timestamp.
+
+    The year is not in the stream, so it is taken to be the current
+    year (as of now, which defaults to the current time) -- unless
+    that would put the sample more than half a year in the future, in
+    which case it's the previous year.
+
+    """
+    if now is None:
+        now = time.time()
+    year = time.gmtime(now).tm_year
+    t = _year_start(year) + (day - 1) * 86400 + time_of_day
+    if t > now + 86400 * 183:
+        t = _year_start(year - 1) + (day - 1) * 86400 + time_of_day
+    return t
+
+
+#: Compiled StreamSchemas, by (format, fields).
+_schemas = {}
+
+
+def get_schema(schema):
+    """Return the compiled StreamSchema for schema, which may be a
+    StreamSchema, a stream_schemas entry (dict) or the name of one
+    (e.g. 'v2').  Schemas are compiled on first request, and the same
+    object is returned for subsequent requests.
+
+    """
+    if isinstance(schema, StreamSchema):
+        return schema
+    if isinstance(schema, str):
+        if soaculib.configs.cache is None:
+            soaculib.configs.load()
+        schema = soaculib.get_stream_schema(schema)
+    key = (schema['format'], tuple(schema['fields']))
+    compiled = _schemas.get(key)
+    if compiled is None:
+        compiled = _schemas[key] = StreamSchema.from_config(schema)
+    return compiled
+
+
+class RunningStats:
+    """Count, mean, standard deviation, min and max of a series of
+    values, accumulated in constant memory (Welford's method)."""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = 0.
+        self._m2 = 0.
+        self.min = None
+        self.max = None
+
+    def add(self, x):
+        self.count += 1
+        d = x - self.mean
+        self.mean += d / self.count
+        self._m2 += d * (x - self.mean)
+        if self.min is None or x < self.min:
+            self.min = x
+        if self.max is None or x > self.max:
+            self.max = x
+
+    @property
+    def std(self):
+        if self.count < 2:
+            return None
+        return math.sqrt(self._m2 / (self.count - 1))
+
+
+class StreamHealth:
+    """Health statistics for a broadcast stream, from the Day and Time
+    fields of the decoded samples.  Pass each datagram, as it's
+    received, to add_datagram(); then call report() from time to
+    time.  Memory use is constant.
+
+    The following are counted:
+
+    - dropped: samples missing, judging from gaps in the sample times
+      (relative to the sample period).  If a missing sample arrives
+      later, in an out-of-order datagram, it's taken off again.
+    - duplicated: samples with the same time as one already received
+      (including whole datagrams received twice).
+    - out_of_order: datagrams that arrive after a later one.
+    - restarts: jumps in sample time of more than max_gap seconds
+      (e.g. if the stream was disabled for a while); these are not
+      counted as drops.
+    - bad_size: datagrams that aren't a whole number of samples.
+
+    And, for the interval since the last report(reset=True):
+
+    - interval: statistics of the time between consecutive samples
+      (s); the jitter is interval.std.
+    - offset: statistics of the time of receipt (host clock) minus
+      the time of the latest sample in the datagram (ACU clock).  This
+      is the clock offset plus the transmission delay, so offset.min
+      is the best estimate of the clock offset.
+
+    Args:
+      schema: the stream schema (anything get_schema accepts); it must
+        have 'Day' and 'Time' fields.
+      sample_period (float): nominal time between samples (s).  If
+        None, this is estimated from the spacing of samples within
+        datagrams.
+
+    """
+    #: Number of recent datagram start times to remember, to tell
+    #: duplicated datagrams from late ones.
+    history = 64
+
+    #: Sample time jumps (s) longer than this are counted as restarts.
+    max_gap = 10.
+
+    def __init__(self, schema, sample_period=None):
+        self.schema = get_schema(schema)
+        self.i_day = self.schema.index.get('Day')
+        self.i_time = self.schema.index.get('Time')
+        if self.i_day is None or self.i_time is None:
+            raise ValueError(f'Stream schema {self.schema.name} does not '
+                             f'have Day and Time fields.')
+        self.sample_period = sample_period
+        self._period_est = RunningStats()
+        self.packets = 0
+        self.samples = 0
+        self.dropped = 0
+        self.duplicated = 0
+        self.out_of_order = 0
+        self.restarts = 0
+        self.bad_size = 0
+        self.last_offset = None
+        self.interval = RunningStats()
+        self.offset = RunningStats()
+        self._last = None
+        self._last_recv = None
+        self._recent = collections.deque(maxlen=self.history)
+        self._mark = (None, 0)
+
+    @property
+    def period(self):
+        """The nominal sample period (s), if known."""
+        if self.sample_period is not None:
+            return self.sample_period
+        if self._period_est.count:
+            return self._period_est.mean
+        return None
+
+    def _step(self, dt):
+        # Account for the time between two consecutive samples.
+        if dt == 0:
+            self.duplicated += 1
+            return
+        if dt < 0:
+            return
+        p = self.period
+        if p is None:
+            return
+        missing = round(dt / p) - 1
+        if missing > 0:
+            self.dropped += missing
+        else:
+            self.interval.add(dt)
+
+    def add_datagram(self, data, recv_time=None):
+        """Process a datagram (bytes); recv_time is the host time of
+        receipt, and defaults to now."""
+        if recv_time is None:
+            recv_time = time.time()
+        if self.schema.samples_per_datagram(len(data)) is None:
+            self.bad_size += 1
+            return
+        samples = self.schema.unpack(data)
+        i_day, i_time = self.i_day, self.i_time
+        times = [s[i_day] * 86400. + s[i_time] for s in samples]
+        self.packets += 1
+        self.samples += len(times)
+        if self._mark[0] is None:
+            self._mark = (recv_time, self.samples)
+
+        # Compare to previous datagrams.
+        if times[0] in self._recent:
+            self.duplicated += len(times)
+            return
+        self._recent.append(times[0])
+        if self.sample_period is None:
+            for a, b in zip(times[:-1], times[1:]):
+                dt = b - a
+                p = self.period
+                if dt > 0 and (p is None or 0.5 * p < dt < 1.5 * p):
+                    self._period_est.add(dt)
+        if self._last is not None:
+            gap = times[0] - self._last
+            if abs(gap) > self.max_gap:
+                self.restarts += 1
+            elif times[-1] < self._last:
+                # Late arrival; its samples were counted as dropped.
+                self.out_of_order += 1
+                self.dropped = max(0, self.dropped - len(times))
+                return
+            else:
+                self._step(gap)
+        for a, b in zip(times[:-1], times[1:]):
+            self._step(b - a)
+        self._last = times[-1]
+
+        s = samples[-1]
+        self.last_offset = recv_time - sample_time(s[i_day], s[i_time],
+                                                   recv_time)
+        self.offset.add(self.last_offset)
+        self._last_recv = recv_time
+
+    def report(self, reset=True):
+        """Returns a dict with the counts (since the start) and the
+        interval statistics (since the last reset), including the
+        sample rate (samples/s).  If reset, the interval statistics
+        are then reset.
+
+        """
+        t0, n0 = self._mark
+        rate = None
+        if t0 is not None and self._last_recv is not None \
+           and self._last_recv > t0:
+            rate = (self.samples - n0) / (self._last_recv - t0)
+        output = {
+            'packets': self.packets,
+            'samples': self.samples,
+            'dropped': self.dropped,
+            'duplicated': self.duplicated,
+            'out_of_order': self.out_of_order,
+            'restarts': self.restarts,
+            'bad_size': self.bad_size,
+            'period': self.period,
+            'rate': rate,
+            'interval_mean': self.interval.mean if self.interval.count else None,
+            'interval_min': self.interval.min,
+            'interval_max': self.interval.max,
+            'jitter': self.interval.std,
+            'offset_mean': self.offset.mean if self.offset.count else None,
+            'offset_min': self.offset.min,
+            'offset_max': self.offset.max,
+            'offset_std': self.offset.std,
+        }
+        if reset:
+            self.interval.reset()
+            self.offset.reset()
+            self._mark = (None, 0)
+        return output
+
+
 # As is the case for AcuControl, the public interface for
 # BroadcastStreamControls will be created on instantiation by
 # wrapping the private methods (implemented as generators) with a
@@ -17,26 +365,44 @@ class BroadcastStreamControl:
     INTERFACE = ['safe_enable', 'enable', 'get_status',
                  'set_destination', 'set_port', 'set_config']
 
+    #: Maximum age (s) of a cached developer interface page.  Pages
+    #: are only cached during a safe_enable call, so that its
+    #: get_status calls can reuse them; posts drop the pages they
+    #: affect.
+    page_cache_age = 1.
+
+    #: The page chapters that are changed by a post to each chapter.
+    _POST_INVALIDATES = {'1': ['1'], '3': ['0', '2']}
+
     @classmethod
-    def get_all(cls, config='guess', backend=None):
+    def get_all(cls, config='guess', backend=None, persistent=None):
         """Returns handler objects for all streams in the specified config
-        (use 'guess' to load the config based on hostname).
+        (use 'guess' to load the config based on hostname), as a
+        BroadcastStreamGroup.  The handlers share a single backend
+        (and thus, if persistent, a single connection pool).
 
         """
         config = soaculib.guess_config(config)
+        backend = soaculib.get_backend(
+            backend, persistent=persistent,
+            pool_size=config.get('http_pool_size'))
         output = {}
         for name, stream_cfg in config.get('streams', {}).items():
             if not stream_cfg.get('active', True):
                 continue
-            output[name] = cls(config, stream_cfg, backend=None)
-        return output
+            output[name] = cls(config, stream_cfg, backend=backend)
+        return BroadcastStreamGroup(output, backend=backend)
 
-    def __init__(self, config, stream_config, backend=None):
+    def __init__(self, config, stream_config, backend=None, persistent=None):
         """Args:
 
             config: a system config spec (dict, system name, or
                 'guess').
             stream_config: a stream config spec (dict, stream name).
+            backend: backend name, or instance.  Pass the backend of
+                an AcuControl to share its connections.
+            persistent (bool): if the backend is to be created, whether
+                to keep connections alive.
 
         """
         # Decode configs.
@@ -62,22 +428,51 @@ class BroadcastStreamControl:
         # If config specifies schema by name, replace it with dict.
         if isinstance(self.p['schema'], str):
             self.p['schema'] = soaculib.get_stream_schema(self.p['schema'])
-
-        backend = soaculib.get_backend(backend)
+        #: The compiled StreamSchema, or None.
+        self.schema = None
+        if self.p['schema'] is not None:
+            self.schema = get_schema(self.p['schema'])
+
+        backend = soaculib.get_backend(
+            backend, persistent=persistent,
+            pool_size=config.get('http_pool_size'))
         self.http = ModularHttpInterface(
             self.p['dev_url'], backend=backend)
 
         # Decorate all methods for the chosen backend.
-        for public_name in self.INTERFACE:
-            func = getattr(self, '_' + public_name)
-            setattr(self, '_' + public_name, backend.decorator(func))
-            setattr(self, public_name, backend.api_decorator(func))
+        soaculib.backend.bind_interface(self, self.INTERFACE, backend)
         # Define the appropriate returnValue function.
         self._return_val_func = backend.return_val_func
 
+        # Map from chapter to (time, page text); only used while
+        # _caching (i.e. during safe_enable).
+        self._pages = {}
+        self._caching = False
+
     def _return(self, value):
         self._return_val_func(value)
 
+    def _cached_page(self, chapter):
+        """Return the cached text of a dev interface page, or None if
+        it's not cached or too old."""
+        entry = self._pages.get(chapter) if self._caching else None
+        if entry is None or time.monotonic() - entry[0] > self.page_cache_age:
+            return None
+        return entry[1]
+
+    def _cache_page(self, chapter, text):
+        if self._caching:
+            self._pages[chapter] = (time.monotonic(), text)
+
+    def _posted(self, chapter):
+        """Drop cached pages invalidated by a post to chapter."""
+        for c in self._POST_INVALIDATES.get(chapter, list(self._pages)):
+            self._pages.pop(c, None)
+
+    def clear_cache(self):
+        """Drop all cached dev interface pages."""
+        self._pages.clear()
+
     def _safe_enable(self, force_reconfig=False):
         """Enable the stream, after checking the destination IP and port and
         updating them if need be.
@@ -88,17 +483,24 @@ class BroadcastStreamControl:
         Returns the get_status() output, after enabling the stream.
 
         """
-        if not force_reconfig:
-            # Check the active settings and maybe force a reconfig.
-            _, current_cfg = yield self.get_status()
-            force_reconfig = (self.p['Port'] != int(current_cfg['Port'])) \
-                or (self.p['Destination'] != current_cfg['Destination'])
-        if force_reconfig:
-            yield self.disable()
-            yield self.set_config()
-        yield self.enable()
-        status, cfg = yield self.get_status()
-        self._return((status, cfg))
+        # Start from fresh pages; get_status below may reuse them, but
+        # only until this call returns.
+        self.clear_cache()
+        self._caching = True
+        try:
+            if not force_reconfig:
+                # Check the active settings and maybe force a reconfig.
+                cfg_check, _ = yield self.get_status()
+                force_reconfig = not cfg_check['target_ok']
+            if force_reconfig:
+                yield self.disable()
+                yield self.set_config()
+            yield self.enable()
+            status, cfg = yield self.get_status()
+        finally:
+            self._caching = False
+            self.clear_cache()
+        return (status, cfg)
 
     def _enable(self, enable=True):
         """Enable (or disable) the stream UDP output using the developer
@@ -113,7 +515,8 @@ class BroadcastStreamControl:
         # dump in response to Post, for which we have no reasonable
         # handler.
         output = yield self.http.Post(data, self.p['module'], '3')
-        return self._return('ok')
+        self._posted('3')
+        return 'ok'
 
     # Note the disable function doesn't need wrapping, since it's an
     # alias that does no I/O on its own.
@@ -129,6 +532,10 @@ class BroadcastStreamControl:
         'Enabled', be concerned.  The values for 'Running' are drawn
         from ['True', 'False'].
 
+        Within a safe_enable call, pages fetched less than
+        page_cache_age seconds ago (and not since changed through this
+        object) are reused.
+
         The "cfg_check" has two entries:
 
         - 'target_ok' (bool): True if the Destination and Port agree
@@ -138,42 +545,102 @@ class BroadcastStreamControl:
 
         """
         # Chapter 0 is "Actual Values"
-        text = yield self.http.Get(self.p['module'], '0')
-        te = soaculib.util.TableExtractor()
-        te.feed(text)
-        results = te.simple_search(['Running'], 0, 1)
+        text = self._cached_page('0')
+        if text is None:
+            text = yield self.http.Get(self.p['module'], '0')
+            self._cache_page('0', text)
+        results = soaculib.util.search_tables(text, ['Running'], 0, 1)
 
         # Chapter 1 is "Parameters"
-        text = yield self.http.Get(self.p['module'], '1')
-        te = soaculib.util.TableExtractor()
-        te.feed(text)
-        results.update(te.simple_search(['Port', 'Destination'], 0, 1))
+        text = self._cached_page('1')
+        if text is None:
+            text = yield self.http.Get(self.p['module'], '1')
+            self._cache_page('1', text)
+        results.update(soaculib.util.search_tables(
+            text, ['Port', 'Destination'], 0, 1))
 
         # Is that as expected?
         cfg_check = {
             'target_ok': ((results.get('Port') == str(self.p['Port'])) and
                           (results.get('Destination') == self.p['Destination'])),
             'enabled': results.get('Running', 'False') == 'True'}
-        return self._return((cfg_check, results))
+        return (cfg_check, results)
 
     def _set_destination(self, destination=None):
         if destination is None:
             destination = self.p['Destination']
         data = {'name': 'Destination', 'value': destination}
         output = yield self.http.Post(data, self.p['module'], '1')
-        return self._return('ok')
+        self._posted('1')
+        return 'ok'
         
     def _set_port(self, port=None):
         if port is None:
             port = int(self.p['Port'])
         data = {'name': 'Port', 'value': str(port)}
         output = yield self.http.Post(data, self.p['module'], '1')
-        return self._return('ok')
+        self._posted('1')
+        return 'ok'
         
     def _set_config(self, destination=None, port=None):
         r1 = yield self.set_destination(destination)
         r2 = yield self.set_port(port)
-        return self._return((r1, r2))
+        return (r1, r2)
+
+
+class BroadcastStreamGroup(dict):
+    """A set of BroadcastStreamControl, keyed by stream name, with
+    methods that act on all of them (or on a subset, given by names)
+    concurrently.  The results are returned as a dict, keyed by stream
+    name.
+
+    The standard backend uses a thread per stream; the twisted backend
+    runs the requests in parallel on the reactor.  Either way,
+    configuring several streams takes about as long as configuring
+    one.
+
+    """
+    INTERFACE = ['get_status', 'safe_enable', 'enable']
+
+    def __init__(self, streams=None, backend=None):
+        super().__init__(streams or {})
+        backend = soaculib.get_backend(backend)
+        self.backend = backend
+        soaculib.backend.bind_interface(self, self.INTERFACE, backend)
+        self._call_all = backend.decorator(self._call_all)
+        self._return_val_func = backend.return_val_func
+
+    def _return(self, value):
+        self._return_val_func(value)
+
+    def _call_all(self, method, names, *args, **kwargs):
+        if names is None:
+            names = list(self.keys())
+        funcs = [functools.partial(getattr(self[name], method),
+                                   *args, **kwargs)
+                 for name in names]
+        results = yield from soaculib.backend.gather(self.backend, funcs)
+        return dict(zip(names, results))
+
+    def _get_status(self, names=None):
+        """Run get_status for each stream."""
+        results = yield self._call_all('get_status', names)
+        return results
+
+    def _safe_enable(self, names=None, force_reconfig=False):
+        """Run safe_enable for each stream."""
+        results = yield self._call_all('safe_enable', names,
+                                       force_reconfig=force_reconfig)
+        return results
+
+    def _enable(self, names=None, enable=True):
+        """Enable (or disable) each stream; see
+        BroadcastStreamControl.enable."""
+        results = yield self._call_all('enable', names, enable)
+        return results
+
+    def disable(self, names=None):
+        return self.enable(names, False)
 
 
 class ModularHttpInterface:
@@ -5,7 +5,8 @@ import soaculib
 
 from twisted.internet import reactor
 from twisted.internet.defer import (
-    inlineCallbacks, Deferred, DeferredList, returnValue)
+    inlineCallbacks, Deferred, DeferredList, returnValue,
+    gatherResults, maybeDeferred, FirstError)
 import twisted.web.client as tclient
 from twisted.web.http_headers import Headers
 
@@ -19,10 +20,14 @@ class TwistedHttpBackend(soaculib._Backend):
 
     """
 
-    def __init__(self, web_agent=None, persistent=False):
+    def __init__(self, web_agent=None, persistent=False, pool_size=None):
         """Instances of this class will make use of a twisted.web.client.Agent
         instance to perform web requests asynchronously.
 
+        If persistent, the Agent uses an HTTPConnectionPool, keeping
+        up to pool_size connections per host alive (the twisted
+        default is 2).
+
         """
         self.decorator = inlineCallbacks
         self.api_decorator = inlineCallbacks
@@ -31,6 +36,8 @@ class TwistedHttpBackend(soaculib._Backend):
         if web_agent is None:
             if persistent:
                 pool = tclient.HTTPConnectionPool(reactor)
+                if pool_size is not None:
+                    pool.maxPersistentPerHost = pool_size
                 web_agent = tclient.Agent(reactor, pool=pool)
             else:
                 web_agent = tclient.Agent(reactor)
@@ -48,10 +55,15 @@ class TwistedHttpBackend(soaculib._Backend):
                 b'GET', bytes(full_url, 'utf-8'))
         elif req.req_type == 'POST':
             headers = {}
+            data = req.data
+            if isinstance(data, dict):
+                # Form data, as for the developer interface.
+                data = urllib.parse.urlencode(data)
+                headers[b'Content-Type'] = [b'application/x-www-form-urlencoded']
             defd = self.web_agent.request(
                 b'POST', bytes(full_url, 'utf-8'),
                 Headers(headers),
-                tclient.FileBodyProducer(BytesIO(bytes(req.data, 'utf-8'))))
+                tclient.FileBodyProducer(BytesIO(bytes(data, 'utf-8'))))
         else:
             raise ValueError("Unimplemented request type '%s'" % req.req_type)
         
@@ -74,3 +86,17 @@ class TwistedHttpBackend(soaculib._Backend):
         d = Deferred()
         reactor.callLater(delay, d.callback, None)
         yield d
+
+    @inlineCallbacks
+    def gather(self, funcs):
+        """Call each function in funcs (with no arguments), and return a
+        Deferred that fires with the list of results once all have
+        completed.  If any fail, the first failure is raised.
+
+        """
+        try:
+            results = yield gatherResults([maybeDeferred(f) for f in funcs],
+                                          consumeErrors=True)
+        except FirstError as e:
+            e.subFailure.raiseException()
+        return results
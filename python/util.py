@@ -1,4 +1,6 @@
 import calendar
+import html
+import re
 import time
 from html.parser import HTMLParser
 
@@ -127,3 +129,80 @@ class TableExtractor(HTMLParser):
                 if k in keys:
                     output[k] = v
         return output
+
+
+
+# Comments, and the table structure tags.
+_TABLE_TAGS = re.compile(r'<!--.*?-->|<(/?)(table|tr|td|th)\b[^>]*>',
+                         re.DOTALL | re.IGNORECASE)
+# Any other tag, in the text between those.
+_OTHER_TAGS = re.compile(r'<!--.*?-->|<[^>]*>', re.DOTALL)
+
+
+def search_tables(text, keys, index_col, data_col):
+    """Look in HTML tables for rows where the value in column index_col
+    (int) matches an entry in keys (list of str), and return a dict
+    with the value from column data_col (int) of each such row.  Keys
+    that aren't found map to None.
+
+    This gives the same results as TableExtractor.simple_search (with
+    rows split into columns in the same way), except that if a key
+    appears in several rows the first one is used.  It is much faster
+    on large pages, because it only visits the table structure tags,
+    keeps only the current row of each open table, and stops as soon
+    as all the keys have been found.  The text may be str or (utf-8)
+    bytes.
+
+    """
+    if isinstance(text, bytes):
+        text = text.decode('utf-8', errors='replace')
+    output = {k: None for k in keys}
+    todo = {k for k in keys if k in text}
+    if not todo:
+        return output
+
+    # For each open table, its current row (or None).
+    rows = []
+    dest = None
+    pos = 0
+
+    def check(row):
+        if row is not None and len(row) > max(index_col, data_col):
+            k = row[index_col]
+            if k in todo:
+                output[k] = row[data_col]
+                todo.discard(k)
+
+    for m in _TABLE_TAGS.finditer(text):
+        if dest is not None and m.start() > pos:
+            chunk = text[pos:m.start()]
+            if '<' in chunk or '&' in chunk:
+                dest.extend(html.unescape(t) for t in
+                            _OTHER_TAGS.split(chunk) if t)
+            else:
+                dest.append(chunk)
+        pos = m.end()
+        tag = m.group(2)
+        if tag is None:
+            continue
+        tag = tag.lower()
+        if m.group(1):
+            if tag == 'table' and rows:
+                check(rows.pop())
+            elif tag == 'tr' and rows:
+                check(rows[-1])
+                rows[-1] = None
+            elif tag in ['td', 'th']:
+                dest = None
+        elif tag == 'table':
+            rows.append(None)
+        elif not rows:
+            continue
+        elif tag == 'tr':
+            check(rows[-1])
+            rows[-1] = []
+        elif tag in ['td', 'th'] and rows[-1] is not None:
+            dest = rows[-1]
+        if not todo:
+            break
+    return output
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+from urllib.parse import urlsplit, parse_qs
+
+logger = logging.getLogger(__name__)
+
+REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    500: 'Internal Server Error',
+}
+
+
+class AsyncHttpServer:
+    """Minimal asyncio HTTP/1.1 server, for serving the simulator
+    routes at high request rates.  Connections are kept alive unless
+    the client asks otherwise.
+
+    Args:
+        routes (dict): Map from path (e.g. '/Values') to tuple
+            (methods, handler).  The handler is called as
+            handler(args, data), where args is a dict of the query
+            parameters and data is the request body (bytes), and must
+            return a tuple (body, status, mimetype).
+        host (str): Address to listen on.
+        port (int): Port to listen on.
+
+    """
+    def __init__(self, routes, host='localhost', port=8102):
+        self.routes = routes
+        self.host = host
+        self.port = port
+        self.server = None
+
+    async def start(self):
+        """Start listening for connections."""
+        self.server = await asyncio.start_server(
+            self._handle, self.host, self.port)
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def _read_body(self, reader, headers):
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                chunk = await reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                chunks.append(chunk[:-2])
+            return b''.join(chunks)
+        n = int(headers.get('content-length', 0))
+        if n:
+            return await reader.readexactly(n)
+        return b''
+
+    def _dispatch(self, method, target, data):
+        url = urlsplit(target)
+        route = self.routes.get(url.path)
+        if route is None:
+            return b'', 404, 'text/plain'
+        methods, handler = route
+        if method not in methods:
+            return b'', 405, 'text/plain'
+        args = {k: v[0] for k, v in
+                parse_qs(url.query, keep_blank_values=True).items()}
+        try:
+            return handler(args, data)
+        except Exception as e:
+            logger.exception('Error handling %s %s', method, target)
+            return str(e), 500, 'text/plain'
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except asyncio.IncompleteReadError:
+                    break
+                lines = head.decode('latin-1').split('\r\n')
+                method, target, version = lines[0].split(' ', 2)
+                headers = {}
+                for line in lines[1:]:
+                    if ':' in line:
+                        k, v = line.split(':', 1)
+                        headers[k.strip().lower()] = v.strip()
+                data = await self._read_body(reader, headers)
+
+                body, status, mimetype = self._dispatch(method, target, data)
+                if isinstance(body, str):
+                    body = body.encode('utf-8')
+                conn = headers.get('connection', '').lower()
+                keep_alive = (conn != 'close' and
+                              (version != 'HTTP/1.0' or conn == 'keep-alive'))
+                writer.write(
+                    (f'HTTP/1.1 {status} {REASONS.get(status, "")}\r\n'
+                     f'Content-Type: {mimetype}\r\n'
+                     f'Content-Length: {len(body)}\r\n'
+                     f'Connection: {"keep-alive" if keep_alive else "close"}\r\n'
+                     '\r\n').encode('latin-1') + body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
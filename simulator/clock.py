@@ -0,0 +1,100 @@
+import time
+from threading import Condition, get_ident
+
+
+class Clock:
+    """Source of time for the simulator.
+
+    All simulator components should get the time, and sleep, through
+    a shared Clock object, so that they stay consistent when time is
+    accelerated.  Simulated time runs at rate times real time, starting
+    from start.
+
+    Args:
+        rate (float): Time acceleration factor.
+        start (float): Unix timestamp at which to start the clock;
+            defaults to the current time.
+
+    """
+    def __init__(self, rate=1., start=None):
+        if rate <= 0:
+            raise ValueError('Clock rate must be positive.')
+        if start is None:
+            start = time.time()
+        self.rate = rate
+        self._t0 = start
+        self._m0 = time.monotonic()
+
+    def time(self):
+        """Return the current simulated unix time."""
+        return self._t0 + (time.monotonic() - self._m0) * self.rate
+
+    def sleep(self, seconds):
+        """Sleep for some amount of simulated time."""
+        time.sleep(seconds / self.rate)
+
+
+class SteppedClock(Clock):
+    """Virtual clock that only advances when step() is called.
+
+    Calls to sleep() block until the time has been stepped past the
+    requested wake-up time.  This can be used to drive a simulation as
+    fast as the host allows, or in lock-step with a test harness.
+
+    A thread woken by step() is considered busy until it calls sleep()
+    again; step(..., wait=True) returns only once the threads it woke
+    are all sleeping again.
+
+    Args:
+        start (float): Unix timestamp at which to start the clock;
+            defaults to the current time.
+
+    """
+    def __init__(self, start=None):
+        if start is None:
+            start = time.time()
+        self.rate = None
+        self._t = start
+        self._cond = Condition()
+        self._sleepers = {}
+        self._busy = set()
+
+    def time(self):
+        return self._t
+
+    def step(self, seconds, wait=False):
+        """Advance the clock and wake any sleepers that are due.  If
+        wait, block until those threads have gone back to sleep (i.e.
+        have caught up to the new time).  Returns the new time.
+
+        """
+        with self._cond:
+            self._t += seconds
+            for thread, wake in list(self._sleepers.items()):
+                if wake <= self._t:
+                    del self._sleepers[thread]
+                    self._busy.add(thread)
+            self._cond.notify_all()
+            if wait:
+                self._cond.wait_for(lambda: not self._busy)
+            return self._t
+
+    def sleep(self, seconds):
+        thread = get_ident()
+        with self._cond:
+            wake = self._t + seconds
+            self._busy.discard(thread)
+            self._sleepers[thread] = wake
+            self._cond.notify_all()
+            self._cond.wait_for(lambda: self._t >= wake)
+            self._sleepers.pop(thread, None)
+
+
+def get_clock(rate=1., start=None):
+    """Return a SteppedClock if rate is 0 (or None), and a Clock
+    running at the specified rate otherwise.
+
+    """
+    if not rate:
+        return SteppedClock(start=start)
+    return Clock(rate=rate, start=start)
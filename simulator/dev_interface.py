@@ -0,0 +1,95 @@
+"""Emulation of the ACU "developer" web interface, for the
+PositionBroadcast modules only.
+
+The real interface serves a page per Module and Chapter (e.g.
+``/?Module=Services.PositionBroadcast&Chapter=1``), with values laid
+out in HTML tables; see soaculib.streams.BroadcastStreamControl.  The
+pages generated here are much simpler but have the same Name / Value
+table rows, so they can be parsed by soaculib.util.TableExtractor.
+
+Chapters:
+
+- 0 (Actual Values): 'Running', and a packet count.
+- 1 (Parameters): 'Destination' and 'Port'.  POST with data
+  name=<param>&value=<value> to change one.
+- 2 (Target Values): empty.
+- 3 (Commands): POST with Command=Enable or Command=Disable.
+
+"""
+import html
+from urllib.parse import parse_qs
+
+CHAPTERS = {
+    0: 'Actual Values',
+    1: 'Parameters',
+    2: 'Target Values',
+    3: 'Commands',
+}
+
+
+def _rows(rows):
+    return ''.join(f'<tr><td>{html.escape(str(k))}</td>'
+                   f'<td>{html.escape(str(v))}</td></tr>'
+                   for k, v in rows)
+
+
+def render_page(module, chapter, udp):
+    """Return the HTML page for a chapter of a stream module.
+
+    Args:
+        module (str): Module name, e.g. 'Services.PositionBroadcast'.
+        chapter (int): Chapter number (see CHAPTERS).
+        udp (AcuUdpServer): The stream.
+
+    """
+    if chapter == 0:
+        rows = [('Running', str(udp.enabled)),
+                ('Packets Sent', udp.packets_sent)]
+    elif chapter == 1:
+        rows = [('Destination', udp.host),
+                ('Port', udp.write_port)]
+    else:
+        rows = []
+    body = (f'<table><tr><th>{html.escape(module)}</th>'
+            f'<th>{CHAPTERS[chapter]}</th></tr>'
+            f'<tr><th>Name</th><th>Value</th></tr>{_rows(rows)}</table>')
+    if chapter == 3:
+        body += ''.join(f'<form method="post"><input type="submit" '
+                        f'name="Command" value="{c}"></form>'
+                        for c in ['Enable', 'Disable'])
+    return (f'<html><head><title>{html.escape(module)}</title></head>'
+            f'<body>{body}</body></html>')
+
+
+def handle_post(chapter, data, udp):
+    """Apply a POST to a chapter of a stream module.
+
+    Args:
+        chapter (int): Chapter number (see CHAPTERS).
+        data (bytes): The form-encoded request body.
+        udp (AcuUdpServer): The stream.
+
+    Returns:
+        An error string, or None if the request was applied.
+
+    """
+    form = {k: v[0] for k, v in parse_qs(data.decode('utf-8')).items()}
+    if chapter == 3:
+        cmd = form.get('Command')
+        if cmd not in ['Enable', 'Disable']:
+            return f'Invalid Command: {cmd}'
+        udp.enable(cmd == 'Enable')
+    elif chapter == 1:
+        name, value = form.get('name'), form.get('value')
+        if name == 'Destination':
+            udp.host = value
+        elif name == 'Port':
+            try:
+                udp.write_port = int(value)
+            except (TypeError, ValueError):
+                return f'Invalid Port: {value}'
+        else:
+            return f'Invalid parameter: {name}'
+    else:
+        return f'Nothing to post in Chapter {chapter}'
+    return None
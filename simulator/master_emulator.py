@@ -1,9 +1,12 @@
 import numpy as np
+import json
 import time
 import datetime as dt
-from scipy.interpolate import CubicSpline, interp1d
 import server_keys as sk
-from threading import Thread
+from threading import Thread, RLock
+from types import MappingProxyType
+from track_engine import TrackEngine, parse_track
+from clock import Clock
 
 TZ = dt.timezone.utc
 
@@ -26,7 +29,22 @@ def find_day_of_year(now):
     acu_day = day_of_year + day_part
     return acu_day, day_of_year, seconds
 
-def initialize_data_dict(dataset, set_time=True, set_defaults=True):
+
+def acu_time(t):
+    """Like find_day_of_year, but starting from a unix timestamp (and
+    without building a datetime object).
+
+    Returns: tuple (Day, Integer, Seconds, Year), where Day is the
+      fractional day of year (starting from 1), Integer is the integer
+      day number, Seconds is the number of seconds since midnight and
+      Year is the year.
+
+    """
+    tm = time.gmtime(t)
+    seconds = t % 86400
+    return (tm.tm_yday + seconds / 86400, tm.tm_yday, seconds, tm.tm_year)
+
+def initialize_data_dict(dataset, set_time=True, set_defaults=True, now=None):
     """Load server keys from module and populate with sensible starting values.
 
     Args:
@@ -34,6 +52,8 @@ def initialize_data_dict(dataset, set_time=True, set_defaults=True):
         set_time (bool): If True, include date/time in the dataset.
         set_defaults (bool): If True, treat this is the main "general" dataset
              and put in the starting positions.
+        now (float): Unix timestamp to use for date/time; defaults to
+             the current time.
 
     Returns:
         dict: Data dictionary with all values initialized.
@@ -51,11 +71,12 @@ def initialize_data_dict(dataset, set_time=True, set_defaults=True):
             data[key] = 0.0
 
     if set_time:
-        init_now = dt.datetime.now(TZ)
-        init_time, init_day, init_hms = find_day_of_year(init_now)
+        if now is None:
+            now = time.time()
+        init_time, init_day, init_hms, init_year = acu_time(now)
         data['Day'] = init_day
         data['Time_UDP'] = init_hms
-        data['Year'] = init_now.year
+        data['Year'] = init_year
         data['Time'] = init_time
 
     if set_defaults:
@@ -77,31 +98,64 @@ def initialize_data_dict(dataset, set_time=True, set_defaults=True):
 class DataMaster:
     """ACU Data container class.
 
+    All motion is computed by a single scheduler (see run()), which
+    advances every axis, in whatever mode it is in, at a fixed tick
+    rate using one clock.  Commands (from the HTTP server)
+    only record new targets, rates and modes.  At the end of each tick
+    an immutable snapshot of the data registers is published; that is
+    what values() returns to the HTTP and UDP servers.
+
     Attributes:
-        data (dict): Dictionary tracking values of internal data registers.
-        queue (dict): Acts as the stack of points being uploaded via
-            UploadPtStack.
-        running (bool): True if currently running a track (via run_track()),
-            False if not running.
+        data (dict): Dictionary tracking values of internal data
+            registers.  Only modify this while holding lock.
+        track (TrackEngine): Acts as the stack of points being uploaded
+            via UploadPtStack, and interpolates them.
+        running (bool): True if currently running a track, False if not
+            running.
+        tick_period (float): Time (s) between scheduler ticks.
+        lock (RLock): Lock protecting data, track, and the axis states.
+        clock (Clock): The source of simulated time.
 
     Args:
         dataset (str): Name of dataset, i.e. 'Datasets.StatusSATPDetailed8100'
+        tick_rate (float): Scheduler tick rate (Hz, in simulated time).
+        clock (Clock): The source of simulated time; defaults to a
+            real-time Clock.
 
     """
-    def __init__(self, dataset):
-        self.data = initialize_data_dict(dataset)
-        self.queue = self._initialize_queue()
+    #: Preset mode slew speeds (deg/s).
+    PRESET_SPEEDS = {
+        'Azimuth': 6.,
+        'Elevation': 6.,
+        'Boresight': 1.,
+    }
+
+    def __init__(self, dataset, tick_rate=200., clock=None):
+        if clock is None:
+            clock = Clock()
+        self.clock = clock
+        self.data = initialize_data_dict(dataset, now=clock.time())
+        self.track = TrackEngine()
         self.running = False
+        self.tick_period = 1. / tick_rate
+        self.lock = RLock()
+        # Motion state for each axis; the Preset motion plan and the
+        # commanded Rate.
+        self.axes = {axis: {'plan': None, 'rate': 0.}
+                     for axis in self.PRESET_SPEEDS}
+        self._rng = np.random.default_rng()
+        self._last_tick = None
+        self._snapshot = None
+        self._snapshot_json = (None, None)
+        self._listeners = []
+        self.tick()
+
+    def now(self):
+        """Return the current (unix) time, according to the simulator
+        clock.
 
-    @staticmethod
-    def _initialize_queue():
-        queue = {'times': [],
-                 'azs': [],
-                 'els': [],
-                 'azflags': [],
-                 'free': 10000}
-
-        return queue
+        """
+        return self.clock.time()
 
     def clear_queue(self):
         """Clear the queue by reinitializing it as empty.
@@ -109,20 +163,24 @@ class DataMaster:
         If we're clearing the queue it's likely because we're trying to stop
         motion, so also set self.running to False, and set the velocity to zero.
         """
-        self.queue = self._initialize_queue()
-        self.running = False
-        self.update_data('Azimuth current velocity', 0.)  # Since we've stopped
+        with self.lock:
+            self.track = TrackEngine()
+            self.running = False
+            self.update_data({'Azimuth current velocity': 0.,  # Since we've stopped
+                              'Elevation current velocity': 0.})
+            self.update_queue()
 
-    def update_timestamp(self):
+    def update_timestamp(self, now=None):
         """Update 'Day', 'Time_UDP', Year', and 'Time' fields in data dict with
-        the current time.
+        the current time (or with the unix timestamp now).
 
         """
-        now = dt.datetime.now(TZ)
-        nowtime, nowday, nowhms = find_day_of_year(now)
+        if now is None:
+            now = self.now()
+        nowtime, nowday, nowhms, year = acu_time(now)
         self.data['Day'] = nowday
         self.data['Time_UDP'] = nowhms
-        self.data['Year'] = now.year
+        self.data['Year'] = year
         self.data['Time'] = nowtime
 
     def update_positions(self, new_az=None, new_el=None, new_bs=None):
@@ -140,95 +198,17 @@ class DataMaster:
             self.data['Corrected Boresight'] = new_bs
 
     def update_data(self, key, new_value=None):
-        if isinstance(key, dict):
-            assert new_value is None
-            self.data.update(key)
-        else:
-            self.data[key] = new_value
+        with self.lock:
+            if isinstance(key, dict):
+                assert new_value is None
+                self.data.update(key)
+            else:
+                self.data[key] = new_value
 
     def update_queue(self):
         """Update the queue, primarily to track the uploaded point stack."""
-        self.queue['free'] = 10000 - len(self.queue['times'])
-        self.update_data('Qty of free program track stack positions', self.queue['free'])
-
-    def _run_preset_thread(self):
-
-        target = None
-        all_data = {
-            'Azimuth': {
-                'target': None,
-                'speed': 6.,
-            },
-            'Elevation': {
-                'target': None,
-                'speed': 6.,
-            },
-            'Boresight': {
-                'target': None,
-                'speed': 1.,
-            },
-        }
-
-        while True:
-            now = time.time()
-            active_axes = []
-            for axis, data in all_data.items():
-                if self.data[f'{axis} mode'] != 'Preset':
-                    # Clear the target on mode transition to make sure
-                    # you repopulate state.
-                    data['target'] = None
-                    continue
-                active_axes.append(axis)
-
-                # Move towards the target position.
-                current_pos = self.data[f'Raw {axis}']
-                new_target = self.data[f'{axis} commanded position']
-                if data['target'] is None or data['target'] != new_target:
-                    # Motion plan ...
-                    speed = data['speed']
-                    data.update({
-                        'target': new_target,
-                        'start_time': now,
-                        'start_pos': current_pos,
-                        'end_time': abs(new_target - current_pos) / speed + now,
-                        'vel': np.sign(new_target - current_pos) * speed,
-                    })
-
-                if current_pos != data['target']:
-                    if now >= data['end_time']:
-                        data['pos'] = data['target']
-                        data['vel'] = 0.
-                    else:
-                        data['pos'] = data['start_pos'] + data['vel'] * (now - data['start_time'])
-
-            if len(active_axes):
-                self.update_timestamp()
-                _up_pos = {}
-                _up_dat = {}
-                if 'Azimuth' in active_axes:
-                    _up_pos['new_az'] = all_data['Azimuth'].get('pos')
-                    v_az = all_data['Azimuth'].get('vel', 0.)
-                    _up_dat.update({
-                        'Azimuth Current 1': v_az * (0.5 + 0.01 * np.random.random()),
-                        'Azimuth Current 2': v_az * (0.5 + 0.01 * np.random.random()),
-                        'Azimuth current velocity': v_az,
-                    })
-                if 'Elevation' in active_axes:
-                    _up_pos['new_el'] = all_data['Elevation'].get('pos')
-                    v_el = all_data['Elevation'].get('vel', 0.)
-                    _up_dat.update({
-                        'Elevation Current 1': v_el * (0.5 + 0.01 * np.random.random()),
-                        'Elevation current velocity': v_el,
-                    })
-                if 'Boresight' in active_axes:
-                    _up_pos['new_bs'] = all_data['Boresight'].get('pos')
-
-                self.update_positions(**_up_pos)
-                self.update_data(_up_dat)
-                time.sleep(0.001)
-
-            else:
-                time.sleep(0.1)
+        self.update_data('Qty of free program track stack positions',
+                         self.track.free)
 
     def preset_azel_motion(self, new_az=None, new_el=None):
         """Update the target positions for az, el or boresight.  When
@@ -236,47 +216,38 @@ class DataMaster:
         constant velcocity.
 
         """
-        if new_az is not None:
-            self.data['Azimuth commanded position'] = new_az
-        if new_el is not None:
-            self.data['Elevation commanded position'] = new_el
+        with self.lock:
+            if new_az is not None:
+                self.data['Azimuth commanded position'] = new_az
+            if new_el is not None:
+                self.data['Elevation commanded position'] = new_el
         return True
 
     def preset_bs_motion(self, new_bs):
-        self.data['Boresight commanded position'] = new_bs
+        self.update_data('Boresight commanded position', new_bs)
+
+    def set_rate(self, axis, rate):
+        """Set the velocity (deg/s) for axis ('Azimuth', 'Elevation' or
+        'Boresight') to move at when in Rate mode.
+
+        """
+        with self.lock:
+            self.axes[axis]['rate'] = rate
 
     def change_mode(self, axes=[], modes=[]):
         if len(axes) != len(modes):
             return
-        for i in range(len(axes)):
-            self.data[axes[i] + " mode"] = modes[i]
-            if modes[i] == 'Stop':
-                self.data[axes[i] + " brakes released"] = False
-            elif modes[i] == 'Preset':
-                self.data[axes[i] + " brakes released"] = True
-
-    @staticmethod
-    def _calculate_udp_time(line):
-        """Calculate the UDP Time for a give line uploaded to the queue.
-
-        For more on the format see `upload_track()`.
-
-        Args:
-            line (str): Single decoded line from queue.
-
-        """
-        # Example: '168, 19:11:22.342642; 27.414830; 35.000000; ...'
-        acutime = line.split(';')[0]
-        #day = int(acutime.split(', ')[0])
-        utime = acutime.split(', ')[1]
-        hr = float(utime.split(':')[0])
-        mn = float(utime.split(':')[1])
-        sc = float(utime.split(':')[2])
-        timeudp = hr * 60. * 60. + mn * 60. + sc
-        return timeudp
+        with self.lock:
+            for i in range(len(axes)):
+                self.data[axes[i] + " mode"] = modes[i]
+                if modes[i] == 'Stop':
+                    self.data[axes[i] + " brakes released"] = False
+                elif modes[i] in ['Preset', 'ProgramTrack', 'Rate']:
+                    self.data[axes[i] + " brakes released"] = True
 
     def upload_track(self, lines):
-        """Upload a track to the queue.
+        """Upload a track to the queue.  The track is run whenever
+        the Azimuth or Elevation axis is in ProgramTrack mode.
 
         Args:
             lines (bytes): 'utf-8' bytes encoded string with points to add to
@@ -288,231 +259,187 @@ class DataMaster:
                 $ lines = b'168, 19:11:22.342642; 27.414830; 35.000000; 2.0000; 0.0000; 1; 0\r\n'
 
         """
-        # if we make a PointStack object that's a (or several) queue.Queue(s)
-        # we can just .put() each item into the appropriate queue during the
-        # for loop. Need to understand how the point are used in run_track() first
-        slines = lines.decode('utf-8')
-        linelist = slines.split('\r\n')
-        udptimes = []
-        azpts = []
-        elpts = []
-        azflags = []
-        for line in linelist:
-            # print(line)
-            if len(line):
-                #   day, utime;           azimuth    elevation  ?       ?       azflag  ?
-                # b'168, 19:11:22.342642; 27.414830; 35.000000; 2.0000; 0.0000; 1;      0\r\n'
-                # we want, 'times', 'azs', 'els', 'azflags' out of this
-
-                # 'times'
-                timeudp = self._calculate_udp_time(line)
-                udptimes.append(timeudp)
-
-                # 'az/el/flag'
-                azpt = float(line.split(';')[1])
-                elpt = float(line.split(';')[2])
-                azflag = int(line.split(';')[5])
-                azpts.append(azpt)
-                elpts.append(elpt)
-                azflags.append(azflag)
-
-        # print(self.queue)
-        # print('udptimes len: '+str(len(udptimes)))
-        # print('azflags len: ' + str(len(azflags)))
-        self.queue['times'].extend(udptimes)
-        self.queue['azs'].extend(azpts)
-        self.queue['els'].extend(elpts)
-        self.queue['azflags'].extend(azflags)
-
-        self.queue['free'] = 10000 - len(self.queue['times'])
-        self.update_data('Qty of free program track stack positions', self.queue['free'])
-        print('times', len(self.queue['times']))
-        print('azs', len(self.queue['azs']))
-        print('els', len(self.queue['els']))
-        print('azflags', len(self.queue['azflags']))
-
-    def _update_queue_view(self, group, width):
-        keys = ['times', 'azs', 'els', 'azflags']
-        for key in keys:
-            group[key].append(self.queue[key].pop(0))
-            self.queue['free'] += 1
-            if len(group[key]) > width:
-                group[key].pop(0)
-
-    def _compute_velocity(self, times, posfit):
-        """Compute velocities for a given axis.
-
-        Since we're only looking at four points, and the positions during
-        turnarounds are entirely from fits, we use the position fit to first
-        generate positions at a reasonable time spacing. Then take the gradient
-        of those positions. Finally, fit those results, and return the fit.
-
-        Args:
-            times (list): Times from the interpolation group
-            posfit (scipy.interpolate Object): Position fit, valid for the
-                given times. Used to generate positions to compute velocity
-                from.
+        points = parse_track(lines)
+        with self.lock:
+            self.track.extend(*points)
+            self.update_queue()
 
-        Returns:
-            scipy.interpolate._cubic.CubicSpline: CubicSpline fit for
-            velocities, valid for the times given in the input args.
+    def _step_preset(self, axis, pos, now):
+        """Returns the new (position, velocity) of an axis in Preset
+        mode, moving towards the commanded position at constant speed.
 
         """
-        # This spacing is sort of arbitrary. Trying to capture enough points
-        # that we get a good estimate of the velocity, without computing too
-        # many.
-        t_spacing = np.mean(np.diff(times))/10
-        vel_times = np.arange(times[0], times[-1], t_spacing)
-        az_pos = posfit(vel_times)
-        vels = np.gradient(az_pos, t_spacing)
-        velfit = CubicSpline(vel_times, vels)
-
-        return velfit
-
-    def run_track(self):
-        modes = [self.data['Azimuth mode'], self.data['Elevation mode']]
-        if modes[0] != 'ProgramTrack':
-            return False
+        state = self.axes[axis]
+        target = self.data[f'{axis} commanded position']
+        plan = state['plan']
+        if plan is None or plan['target'] != target:
+            # Motion plan ...
+            speed = self.PRESET_SPEEDS[axis]
+            plan = state['plan'] = {
+                'target': target,
+                'start_time': now,
+                'start_pos': pos,
+                'end_time': abs(target - pos) / speed + now,
+                'vel': np.sign(target - pos) * speed,
+            }
+        if now >= plan['end_time']:
+            return plan['target'], 0.
+        return plan['start_pos'] + plan['vel'] * (now - plan['start_time']), plan['vel']
+
+    def _step_track(self, nowtime):
+        """Advance the ProgramTrack.  Returns the tuple (az, el,
+        az_vel, el_vel), or None if there is no position to report.
+        When the stack runs out, a settling motion is appended and
+        run, and then the stack is cleared.
 
+        """
+        track = self.track
+        if track.remaining == 0:
+            self.running = False
+            return None
         self.running = True
-
-        # queue starts as empty set of 4 empty lists, and the number of free spaces (10000)
-        queue = self.queue
-
-        # only look at this many points from the queue at a time
-        # Note: below code isn't general enough for this to change without other work
-        VIEW_WIDTH = 4
-
-        # initialize the group of points we'll use for interpolations
-        # Idea here is to only every let this be 4 long, and use that group for the interpolations
-        interp_group = {'times': [], 'azs': [], 'els': [], 'azflags': []}
-        for i in range(VIEW_WIDTH):
-            self._update_queue_view(interp_group, VIEW_WIDTH)
-
-        while len(queue['times']):
-            try:
-                self._update_queue_view(interp_group, VIEW_WIDTH)
-            except IndexError:
-                print("Queue is empty, likely trying to stop a run.")
-                break
-
-            # Skip the group after a turnaround group [1, 2, 1, 1]
-            # Note: If VIEW_WIDTH ever changes, this'll need more thought,
-            # you'll want to skip another group for every +2 increase in
-            # VIEW_WIDTH
-            if interp_group['azflags'][0] == 2:
-                continue
-
-            fittimes = interp_group['times']
-            fitazs = interp_group['azs']
-            fitels = interp_group['els']
-
-            if interp_group['azflags'] != [1, 2, 1, 1]:
-                # linear interpolation between normal points in a scan
-                azfit = interp1d(fittimes, fitazs, fill_value="extrapolate")
-                elfit = interp1d(fittimes, fitels, fill_value="extrapolate")
-                valid_until = fittimes[1]
-            else:
-                # cubic spline interpolation for turnarounds
-                try:
-                    azfit = CubicSpline(fittimes, fitazs)
-                    elfit = CubicSpline(fittimes, fitels)
-                    valid_until = fittimes[int(VIEW_WIDTH/2)]
-                except ValueError:
-                    print('Error in CubicSpline computation', flush=True)
-                    print('TIMES:', fittimes, flush=True)
-                    print('AZ:', fitazs, flush=True)
-                    print('EL:', fitels, flush=True)
-                    raise ValueError
-
-            velfit = self._compute_velocity(fittimes, azfit)
-
-            # wait until beginning of the interp_group times
-            nowtime = self.data['Time_UDP']
-            while nowtime < fittimes[0]:
-                time.sleep(0.001)
-                nowtime = self.data['Time_UDP']
-
-            # apply our interpolation and update the self.data object's
-            # positions and timestamps within the time the fit is valid for
-            while nowtime < valid_until:
-                ptrack = [m == 'ProgramTrack' for m in
-                          [self.data['Azimuth mode'], self.data['Elevation mode']]]
-                try:
-                    newaz, newel = None, None
-                    if ptrack[0]:
-                        newaz = float(azfit(nowtime))
-                        self.update_data('Azimuth current velocity', float(velfit(nowtime)))
-                    if ptrack[1] == 'ProgramTrack':
-                        newel = float(elfit(nowtime))
-                    self.update_positions(new_az=newaz, new_el=newel)
-                    self.update_timestamp()
-                    nowtime = self.data['Time_UDP']
-                except ValueError:
-                    time.sleep(0.001)
-                    nowtime = self.data['Time_UDP']
-
-        # this'll be true except when we're trying to abort a scan
-        if self.running:
-            # final_stretch
-            landing = {'times': [], 'azs': [], 'els': [], 'azflags': []}
-            offset = 0.5  # realistic settling time, but won't produce as large an
-                          # amplitude in the settling motion (which would be ~0.8 deg)
-            for i in range(4):
-                landing['times'].append(interp_group['times'][-1] + np.median(np.diff(interp_group['times']))*(i+1) + offset)
-                landing['azs'].append(interp_group['azs'][-1])
-                landing['els'].append(interp_group['els'][-1])
-                landing['azflags'].append(1)
-            interp_group['times'].extend(landing['times'])
-            interp_group['azs'].extend(landing['azs'])
-            interp_group['els'].extend(landing['els'])
-            interp_group['azflags'].extend(landing['azflags'])
-
-            azfit = CubicSpline(interp_group['times'], interp_group['azs'])
-            elfit = CubicSpline(interp_group['times'], interp_group['els'])
-            velfit = self._compute_velocity(interp_group['times'], azfit)
-
-            nowtime = self.data['Time_UDP']
-            while nowtime < interp_group['times'][-1]:
-                newaz = float(azfit(nowtime))
-                newel = float(elfit(nowtime))
-                self.update_positions(newaz, newel, self.data['Raw Boresight'])
-                self.update_data('Azimuth current velocity', float(velfit(nowtime)))
-                # time.sleep(0.0001)
-                self.update_timestamp()
-                nowtime = self.data['Time_UDP']
-
-        # Ensures queue is empty, and velocity set to zero
+        state = track.evaluate(nowtime)
+        if state is not None:
+            return state
+        t_start = track.t_start
+        if t_start is not None and nowtime < t_start:
+            # Wait for the beginning of the track.
+            return None
+        if not track.landing:
+            # Out of points; land.
+            track.land()
+            state = track.evaluate(nowtime)
+            if state is not None:
+                return state
+        # Ensures queue is empty, and velocity set to zero.
         self.clear_queue()
+        return None
+
+    def _step_axes(self, now):
+        dt = 0. if self._last_tick is None else now - self._last_tick
+        self._last_tick = now
+        modes = {axis: self.data[f'{axis} mode'] for axis in self.axes}
+
+        track_state = None
+        if 'ProgramTrack' in [modes['Azimuth'], modes['Elevation']]:
+            track_state = self._step_track(self.data['Time_UDP'])
+        elif self.running:
+            # Track is left alone until ProgramTrack mode resumes.
+            self.running = False
+
+        new_pos, new_vel = {}, {}
+        for i, (axis, mode) in enumerate(modes.items()):
+            pos = self.data[f'Raw {axis}']
+            vel = 0.
+            if mode != 'Preset':
+                self.axes[axis]['plan'] = None
+            if mode == 'Preset':
+                pos, vel = self._step_preset(axis, pos, now)
+            elif mode == 'Rate':
+                vel = self.axes[axis]['rate']
+                pos = pos + vel * dt
+            elif mode == 'ProgramTrack' and axis != 'Boresight':
+                if track_state is not None:
+                    pos, vel = track_state[i], track_state[i + 2]
+            new_pos[axis], new_vel[axis] = pos, vel
+
+        self.update_positions(new_pos['Azimuth'], new_pos['Elevation'],
+                              new_pos['Boresight'])
+        v_az, v_el = new_vel['Azimuth'], new_vel['Elevation']
+        r = self._rng.random(3)
+        self.update_data({
+            'Azimuth Current 1': v_az * (0.5 + 0.01 * r[0]),
+            'Azimuth Current 2': v_az * (0.5 + 0.01 * r[1]),
+            'Azimuth current velocity': v_az,
+            'Elevation Current 1': v_el * (0.5 + 0.01 * r[2]),
+            'Elevation current velocity': v_el,
+        })
+
+    def add_listener(self, func):
+        """Register a function to be called, as func(now, snapshot),
+        after each tick.  It is called from the scheduler thread, so
+        should be quick.
 
-        return True
+        """
+        self._listeners.append(func)
+
+    def tick(self, now=None):
+        """Advance the simulation to the current time (or to the unix
+        timestamp now), publish a new snapshot of the data registers,
+        and pass it to any listeners.
+
+        """
+        with self.lock:
+            if now is None:
+                now = self.now()
+            self.update_timestamp(now)
+            self._step_axes(now)
+            self.update_queue()
+            snapshot = self._snapshot = MappingProxyType(dict(self.data))
+        for func in self._listeners:
+            func(now, snapshot)
 
     def values(self):
-        """Update and return the data dict.
+        """Return the data registers, as of the most recent tick.
 
         This is called each time the /Values endpoint is hit on the simulator
-        server.
+        server, and for each UDP sample.
 
         Returns:
-            dict: The full data dict.
+            MappingProxyType: Read-only view of the full data dict.
 
         """
-        return self.data
+        return self._snapshot
 
-    def _run_background_updates(self):
-        while True:
-            self.update_timestamp()
-            self.update_queue()
-            time.sleep(0.02)
+    def values_json(self):
+        """Return the data registers, as of the most recent tick,
+        encoded as JSON (bytes).  The encoding is only done once per
+        tick, the first time it is requested.
+
+        """
+        snapshot, encoded = self._snapshot_json
+        if snapshot is not self._snapshot:
+            snapshot = self._snapshot
+            encoded = json.dumps(dict(snapshot)).encode('utf-8')
+            self._snapshot_json = (snapshot, encoded)
+        return encoded
 
     def run(self):
         """Run background updates.
 
-        This starts a thread that continuously updates the timestamps and
-        queue, and should be called after initialization.
+        This starts the scheduler thread that continuously updates
+        the timestamps and axis positions, and should be called after
+        initialization.  To drive several DataMasters from one
+        thread, use run_scheduler() instead.
 
         """
-        update_thread = Thread(target=self._run_background_updates)
-        update_thread.start()
-        preset_thread = Thread(target=self._run_preset_thread)
-        preset_thread.start()
+        scheduler_thread = Thread(target=run_scheduler, args=([self],))
+        scheduler_thread.start()
+
+
+def run_scheduler(masters):
+    """Tick one or more DataMasters, forever.  They must share a
+    clock; the shortest of their tick periods is used for all.
+
+    With a real-time clock, ticks that are missed (because the host
+    fell behind) are skipped.  With a stepped clock, each step runs
+    every tick that has come due, at its scheduled time, so that the
+    simulation follows simulated time exactly.
+
+    """
+    clock = masters[0].clock
+    if any(m.clock is not clock for m in masters):
+        raise ValueError('DataMasters must share a clock.')
+    stepped = hasattr(clock, 'step')
+    tick_period = min(m.tick_period for m in masters)
+    next_tick = clock.time()
+    while True:
+        for m in masters:
+            m.tick(next_tick if stepped else None)
+        next_tick += tick_period
+        delay = next_tick - clock.time()
+        if delay > 0:
+            clock.sleep(delay)
+        elif not stepped:
+            # Fell behind; don't try to catch up.
+            next_tick = clock.time()
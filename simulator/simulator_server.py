@@ -1,19 +1,14 @@
-import time
 import os
+import json
+import asyncio
 import logging
-import numpy as np
+import urllib.parse
 from threading import Thread
-from flask import Flask, request, jsonify
 
-from master_emulator import DataMaster, initialize_data_dict
+from master_emulator import DataMaster, initialize_data_dict, run_scheduler
 from udp_server import AcuUdpServer
-
-app = Flask(__name__)
-
-# Simulator globals, updated in main.
-pconfig = {}
-pdata = None
-udp = None
+from clock import get_clock
+import dev_interface
 
 
 # Stuff my ACU says.
@@ -22,151 +17,365 @@ OK_RESPONSES = {
     'send': 'OK, Command send.',
 }
 
+#: ACU module names of the UDP streams, in order, if not specified.
+STREAM_NAMES = ['PositionBroadcast', 'PositionBroadcastExt']
+
+#: Port to serve on for a device URL that doesn't specify one.
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+#: Main status dataset for each platform.
+STATUS_DATASETS = {
+    'satp': 'StatusSATPDetailed8100',
+    'ccat': 'StatusCCATDetailed8100',
+}
+
+
+def text_reply(text, status=200):
+    return text, status, 'text/plain'
+
+
+def json_reply(data, status=200):
+    return json.dumps(data), status, 'application/json'
+
+
+def get_stream_schema(name):
+    """Look up a stream schema (e.g. 'v2') in the soaculib config."""
+    import soaculib
+    if soaculib.configs.cache is None:
+        soaculib.configs.load()
+    return soaculib.get_stream_schema(name)
+
+
+class AcuSimulator:
+    """One simulated ACU: the DataMaster, its UDP broadcast streams,
+    and the HTTP route handlers.
+
+    The route handlers are called as handler(args, data), where args
+    is a dict of query parameters and data is the request body.  They
+    return (body, status, mimetype), and are served either by Flask or
+    by AsyncHttpServer (see routes).
+
+    The "developer" interface pages for the UDP streams (see
+    dev_interface.py) are served at '/'.
+
+    Args:
+        platform (str): 'satp' or 'ccat'.
+        clock (Clock): The source of simulated time.
+        tick_rate (float): Scheduler tick rate (Hz).
+        streams (list): (port, schema) or (port, schema, acu_name)
+            for each UDP stream to broadcast; schema may be a dict or
+            the name of a stream_schemas entry in the soaculib config.
+            The acu_name defaults to the entry of STREAM_NAMES at the
+            same position.
+        http_port (int): Port on which to serve the HTTP interface.
+        extra_ports (list): Other ports on which to serve the same
+            interface (e.g. for a dev_url that differs from base_url).
+        name (str): Name, for logging.
+
+    """
+    def __init__(self, platform='satp', clock=None, tick_rate=200.,
+                 streams=None, http_port=8102, extra_ports=None, name='acu'):
+        if streams is None:
+            streams = [(10008, 'v2')]
+        if platform not in STATUS_DATASETS:
+            raise ValueError(f'Invalid platform: {platform}')
+        self.name = name
+        self.http_port = http_port
+        self.extra_ports = [p for p in (extra_ports or []) if p != http_port]
+        self.pconfig = {'status': STATUS_DATASETS[platform]}
+        # Note that regardless of name from which it is served, we init it
+        # from the SATP one...
+        self.pdata = DataMaster('Datasets.StatusSATPDetailed8100',
+                                tick_rate=tick_rate, clock=clock)
+        self.clock = self.pdata.clock
+        self.udp_servers = []
+        for i, (port, schema, *acu_name) in enumerate(streams):
+            if acu_name:
+                acu_name = acu_name[0]
+            elif i < len(STREAM_NAMES):
+                acu_name = STREAM_NAMES[i]
+            else:
+                acu_name = f'{STREAM_NAMES[0]}{i}'
+            if isinstance(schema, str):
+                schema = get_stream_schema(schema)
+            self.udp_servers.append(AcuUdpServer(port, self.pdata, schema=schema,
+                                                 acu_name=acu_name))
+
+    @classmethod
+    def from_device(cls, device, **kwargs):
+        """Construct a simulator from a soaculib config device block.
+        The HTTP port is taken from base_url (and the interface is
+        also served on the readonly_url and dev_url ports; if a URL has
+        no port, the default for its scheme is used), and the
+        UDP streams from the active entries in streams.
+
+        """
+        streams = []
+        for stream in device.get('streams', {}).values():
+            if stream.get('active', True):
+                streams.append((stream['port'], stream.get('schema', 'v2'),
+                                stream['acu_name']))
+        def url_port(key):
+            # The port in device[key], or the default for its scheme.
+            url = urllib.parse.urlparse(device[key])
+            port = url.port or DEFAULT_PORTS.get(url.scheme)
+            if port is None:
+                raise ValueError(f'Cannot determine a port from {key} '
+                                 f'"{device[key]}".')
+            return port
+        extra_ports = [url_port(k)
+                       for k in ['readonly_url', 'dev_url'] if k in device]
+        return cls(platform=device.get('platform', 'satp'),
+                   streams=streams,
+                   http_port=url_port('base_url'),
+                   extra_ports=sorted(set(extra_ports)),
+                   name=device.get('_name', 'acu'), **kwargs)
+
+    @property
+    def routes(self):
+        """Map from path to (methods, handler), for serving."""
+        return {
+            '/': (['GET', 'POST'], self.dev_page),
+            '/Values': (['GET'], self.get_data),
+            '/Version': (['GET'], self.get_version),
+            '/SimClock': (['GET'], self.sim_clock),
+            '/Command': (['GET'], self.command),
+            '/UploadPtStack': (['POST'], self.upload),
+        }
+
+    def start(self):
+        """Start the UDP streams.  Note these are driven by the
+        DataMaster scheduler, which must be started separately (see
+        DataMaster.run and run_scheduler).
+
+        """
+        for udp in self.udp_servers:
+            udp.run()
+
+    def get_data(self, args, data=None):
+        identifier = args.get('identifier')
+        form = args.get('format')
+        assert form == 'JSON'
+
+        data = {
+            'Not Implemented': identifier
+        }
+
+        tokens = identifier.lower().split('.')
+        if tokens[0] == 'datasets':
+            if tokens[1] == self.pconfig['status'].lower():
+                # Serialized at most once per tick.
+                return self.pdata.values_json(), 200, 'application/json'
+            elif tokens[1] == 'Shutter'.lower():
+                data = {
+                    # ACU dataset has a timestamp too...
+                    'Shutter Closed' : False,
+                    'Shutter Moving' : False,
+                    'Shutter Open' : True,
+                    'Shutter Timeout' : False,
+                    'Shutter Failure' : False,
+                    'Move Interlock' : False,
+                }
+            elif tokens[1] == 'StatusDetailed8100_3rd'.lower():
+                # The LAT co-rotator dataset -- make it look normal but
+                # then copy in some "Boresight" state from self.pdata...
+                vals = self.pdata.values()
+                data = initialize_data_dict(
+                    'DataSets.StatusDetailed8100_3rd', set_defaults=False,
+                    now=self.clock.time())
+                for k in [
+                        'current position',
+                        'brakes released',
+                        'mode',
+                        'commanded position',
+                ]:
+                    data[f'Co-Rotator {k}'] = vals[f'Boresight {k}']
+            elif tokens[1] == 'CmdPointingCorrection'.lower():
+                data = {
+                    'Tiltmeter Az correction AZ'    : 0.062993,
+                    'Tiltmeter Az correction EL'    : -0.001425,
+                    'Tiltmeter El correction AZ'    : 0.0,
+                    'Tiltmeter El correction EL'    : 0.0,
+                    'Tiltmeter Az Temperature'      : 20.1,
+                    'Tiltmeter Az X Raw'            : -970.0,
+                    'Tiltmeter Az Y Raw'            : -3145.0,
+                    'Tiltmeter Az X Yoke'           : -0.001938,
+                    'Tiltmeter Az Y Yoke'           : 0.001071,
+                }
+        elif tokens[:2] == ['antenna', 'skyaxes']:
+            data = self.pdata.values()
+            SkyAxes = {'azimuth': {'Mode': data['Azimuth mode']},
+                       'elevation': {'Mode': data['Elevation mode']},
+                       # The boresight mode (SATP) / corotator mode (LAT)
+                       # are queried throught the common axis
+                       # "Polarisation".
+                       'polarisation': {'Mode': data['Boresight mode']},
+                       }
+            axis = tokens[2]
+            data = SkyAxes[axis]
+
+        return json_reply(data)
 
-@app.route("/Values", methods=["GET"])
-def get_data():
-    identifier = request.args.get('identifier')
-    form = request.args.get('format')
-    assert form == 'JSON'
-
-    data = {
-        'Not Implemented': identifier
-    }
-
-    tokens = identifier.lower().split('.')
-    if tokens[0] == 'datasets':
-        if tokens[1] == pconfig['status'].lower():
-            data = pdata.values()
-            return jsonify(data)
-        elif tokens[1] == 'Shutter'.lower():
-            data = {
-                # ACU dataset has a timestamp too...
-                'Shutter Closed' : False,
-                'Shutter Moving' : False,
-                'Shutter Open' : True,
-                'Shutter Timeout' : False,
-                'Shutter Failure' : False,
-                'Move Interlock' : False,
-            }
-        elif tokens[1] == 'StatusDetailed8100_3rd'.lower():
-            # The LAT co-rotator dataset -- make it look normal but
-            # then copy in some "Boresight" state from pdata...
-            vals = pdata.values()
-            data = initialize_data_dict(
-                'DataSets.StatusDetailed8100_3rd', set_defaults=False)
-            for k in [
-                    'current position',
-                    'brakes released',
-                    'mode',
-                    'commanded position',
+
+    def get_version(self, args, data=None):
+        version = 'Simulator Version 1.0'
+        return text_reply(version)
+
+
+    def sim_clock(self, args, data=None):
+        # Not an ACU plugin -- report (and, for stepped clocks, advance)
+        # the simulator time.
+        advance = args.get('advance')
+        if advance is not None:
+            if not hasattr(self.clock, 'step'):
+                return text_reply('clock is not stepped', 400)
+            # Return once the scheduler has caught up.
+            self.clock.step(float(advance), wait=True)
+        return json_reply({'time': self.clock.time(), 'rate': self.clock.rate})
+
+
+    def command(self, args, data=None):
+        identifier = args.get('identifier')
+        cmd = args.get('command')
+        param = args.get('parameter')
+        ok_val = OK_RESPONSES['exec']
+
+        if identifier == "DataSets.CmdAzElPositionTransfer":
+            if cmd == 'Set Azimuth Elevation':
+                azel = param.split('|')
+                az = float(azel[0])
+                el = float(azel[1])
+                self.pdata.preset_azel_motion(az, el)
+            elif cmd =='Set Azimuth':
+                az = float(param)
+                self.pdata.preset_azel_motion(new_az=az)
+            elif cmd =='Set Elevation':
+                el = float(param)
+                self.pdata.preset_azel_motion(new_el=el)
+            else:
+                return text_reply('command not found')
+        elif identifier == "DataSets.CmdTimePositionTransfer":
+            if cmd == "Clear Stack":
+                self.pdata.clear_queue()
+            elif cmd in [
+                    "Set Profiler On",
+                    "Set Profiler Off",
+                    "Set Interpolation Linear",
+                    "Set Interpolation Spline",
             ]:
-                data[f'Co-Rotator {k}'] = vals[f'Boresight {k}']
-            return data
-        elif tokens[1] == 'CmdPointingCorrection'.lower():
-            data = {
-                'Tiltmeter Az correction AZ'    : 0.062993,
-                'Tiltmeter Az correction EL'    : -0.001425,
-                'Tiltmeter El correction AZ'    : 0.0,
-                'Tiltmeter El correction EL'    : 0.0,
-                'Tiltmeter Az Temperature'      : 20.1,
-                'Tiltmeter Az X Raw'            : -970.0,
-                'Tiltmeter Az Y Raw'            : -3145.0,
-                'Tiltmeter Az X Yoke'           : -0.001938,
-                'Tiltmeter Az Y Yoke'           : 0.001071,
-            }
-    elif tokens[:2] == ['antenna', 'skyaxes']:
-        data = pdata.values()
-        SkyAxes = {'azimuth': {'Mode': data['Azimuth mode']},
-                   'elevation': {'Mode': data['Elevation mode']},
-                   # The boresight mode (SATP) / corotator mode (LAT)
-                   # are queried throught the common axis
-                   # "Polarisation".
-                   'polarisation': {'Mode': data['Boresight mode']},
-                   }
-        axis = tokens[2]
-        data = SkyAxes[axis]
-
-    return jsonify(data)
-
-
-@app.route("/Version", methods=["GET"])
-def get_version():
-    version = 'Simulator Version 1.0'
-    return version
-
-
-@app.route("/Command", methods=["GET"])
-def command():
-    identifier = request.args.get('identifier')
-    cmd = request.args.get('command')
-    param = request.args.get('parameter')
-    ok_val = OK_RESPONSES['exec']
-
-    if identifier == "DataSets.CmdAzElPositionTransfer":
-        if cmd == 'Set Azimuth Elevation':
-            azel = param.split('|')
-            az = float(azel[0])
-            el = float(azel[1])
-            pdata.preset_azel_motion(az, el)
-        elif cmd =='Set Azimuth':
-            az = float(param)
-            pdata.preset_azel_motion(new_az=az)
-        elif cmd =='Set Elevation':
-            el = float(param)
-            pdata.preset_azel_motion(new_el=el)
-        else:
-            return 'command not found'
-    elif identifier == "DataSets.CmdTimePositionTransfer":
-        if cmd == "Clear Stack":
-            pdata.clear_queue()
-            pdata.update_data('Qty of free program track stack positions', pdata.queue['free'])
-        elif cmd in [
-                "Set Profiler On",
-                "Set Profiler Off",
-                "Set Interpolation Linear",
-                "Set Interpolation Spline",
-        ]:
-            pass  # sure, whatever.
+                pass  # sure, whatever.
+            else:
+                return text_reply('command not found')
+        elif identifier == "DataSets.CmdModeTransfer":
+            all_axes = ['Azimuth', 'Elevation', 'Boresight']
+            if cmd == "Set3rdAxisMode":
+                new_mode = param
+                self.pdata.change_mode(axes=['Boresight'], modes=[new_mode])
+            elif cmd == "SetAzElMode":
+                self.pdata.change_mode(axes=['Azimuth', 'Elevation'], modes=[param, param])
+            elif cmd == "SetModes":
+                param = param.split('|')  # Could be 2 or 3 params.
+                axes, modes = zip(*zip(all_axes, param))
+                self.pdata.change_mode(axes=axes, modes=modes)
+                ok_val = OK_RESPONSES['send']
+            elif cmd == 'Stop':
+                self.pdata.change_mode(axes=all_axes, modes=['Stop'] * len(all_axes))
+            else:
+                return text_reply('command not found')
+        elif identifier == "DataSets.CmdAzElVelocityTransfer8100":
+            if cmd == 'Set Azimuth Elevation':
+                vaz, vel = [float(p) for p in param.split('|')]
+                self.pdata.set_rate('Azimuth', vaz)
+                self.pdata.set_rate('Elevation', vel)
+            elif cmd == 'Set Azimuth':
+                self.pdata.set_rate('Azimuth', float(param))
+            elif cmd == 'Set Elevation':
+                self.pdata.set_rate('Elevation', float(param))
+            else:
+                return text_reply('command not found')
+        elif identifier == "DataSets.Cmd3rdAxisVelocityTransfer":
+            self.pdata.set_rate('Boresight', float(param))
+        elif identifier == "DataSets.Cmd3rdAxisPositionTransfer":
+            new_bs = float(param)
+            self.pdata.preset_bs_motion(new_bs)
+        elif identifier == "DataSets.Shutter":
+            assert cmd in ['ShutterOpen', 'ShutterClose']
         else:
-            return 'command not found'
-    elif identifier == "DataSets.CmdModeTransfer":
-        all_axes = ['Azimuth', 'Elevation', 'Boresight']
-        if cmd == "Set3rdAxisMode":
-            new_mode = param
-            pdata.change_mode(axes=['Boresight'], modes=[new_mode])
-        elif cmd == "SetAzElMode":
-            pdata.change_mode(axes=['Azimuth', 'Elevation'], modes=[param, param])
-        elif cmd == "SetModes":
-            param = param.split('|')  # Could be 2 or 3 params.
-            axes, modes = zip(*zip(all_axes, param))
-            pdata.change_mode(axes=axes, modes=modes)
-            ok_val = OK_RESPONSES['send']
-        elif cmd == 'Stop':
-            pdata.change_mode(axes=all_axes, modes=['Stop'] * len(all_axes))
-        else:
-            return 'command not found'
-    elif identifier == "DataSets.Cmd3rdAxisPositionTransfer":
-        new_bs = float(param)
-        pdata.preset_bs_motion(new_bs)
-    elif identifier == "DataSets.Shutter":
-        assert cmd in ['ShutterOpen', 'ShutterClose']
-    else:
-        return 'identifier not found'
-    pdata.values()
-    return ok_val
+            return text_reply('identifier not found')
+        return text_reply(ok_val)
+
+
+    def upload(self, args, data):
+        self.pdata.upload_track(data)
+        return text_reply('ok, command executed')
+
+
+    def dev_page(self, args, data=None):
+        # The developer interface; only stream modules are supported.
+        module = args.get('Module', '')
+        udp = None
+        for u in self.udp_servers:
+            if module == f'Services.{u.acu_name}':
+                udp = u
+        if udp is None:
+            return text_reply(f'Module not found: {module}', 404)
+        try:
+            chapter = int(args.get('Chapter', 0))
+        except ValueError:
+            chapter = -1
+        if chapter not in dev_interface.CHAPTERS:
+            return text_reply(f'Chapter not found: {args.get("Chapter")}', 404)
+        if data:
+            err = dev_interface.handle_post(chapter, data, udp)
+            if err is not None:
+                return text_reply(err, 400)
+        return dev_interface.render_page(module, chapter, udp), 200, 'text/html'
 
 
-@app.route("/UploadPtStack", methods=["POST"])
-def upload():
-    upload_lines = request.data
-    pdata.upload_track(upload_lines)
+def get_flask_app(routes):
+    """Return a Flask app serving routes."""
+    from flask import Flask, Response, request
 
-    # call run_track() in thread so we can continue to upload points
-    if not pdata.running:
-        motion_thread = Thread(target=pdata.run_track)
-        motion_thread.start()
+    app = Flask(__name__)
 
-    return 'ok, command executed'
+    def make_view(handler):
+        def view():
+            body, status, mimetype = handler(request.args, request.get_data())
+            return Response(body, status=status, mimetype=mimetype)
+        return view
+
+    for path, (methods, handler) in routes.items():
+        app.add_url_rule(path, handler.__name__, make_view(handler),
+                         methods=methods)
+    return app
+
+
+def get_farm_devices(config_file, names=None):
+    """Load device blocks from a soaculib config file.  If names is
+    None, all devices with a base_url on localhost are returned.
+
+    """
+    import soaculib
+    config = soaculib.configs.load(config_file)
+    devices = config.get('devices', {})
+    if names is None:
+        return [d for d in devices.values()
+                if urllib.parse.urlparse(d['base_url']).hostname
+                in ['localhost', '127.0.0.1']]
+    return [devices[n] for n in names]
+
+
+async def serve_farm(sims):
+    """Serve the HTTP interfaces of several AcuSimulators on one
+    event loop.
+
+    """
+    from async_server import AsyncHttpServer
+    servers = [AsyncHttpServer(sim.routes, host='localhost', port=port)
+               for sim in sims for port in [sim.http_port] + sim.extra_ports]
+    for server in servers:
+        await server.start()
+    await asyncio.gather(*[server.serve_forever() for server in servers])
 
 
 if __name__ == "__main__":
@@ -176,28 +385,65 @@ if __name__ == "__main__":
         log.disabled = True
 
     port = int(os.getenv('ACUSIM_HTTP_PORT', 8102))
-    udp_port = int(os.getenv('ACUSIM_HTTP_BROADCAST_PORT', 10008))
+    http_server = os.getenv('ACUSIM_HTTP_SERVER', 'flask')
+    if http_server not in ['flask', 'asyncio']:
+        raise ValueError(f'Invalid ACUSIM_HTTP_SERVER: {http_server}')
+    udp_ports = [int(p) for p in
+                 os.getenv('ACUSIM_HTTP_BROADCAST_PORT', '10008').split(',')]
+    schemas = os.getenv('ACUSIM_STREAM_SCHEMA', 'v2').split(',')
+    if len(schemas) == 1:
+        schemas = schemas * len(udp_ports)
+    if len(schemas) != len(udp_ports):
+        raise ValueError('ACUSIM_STREAM_SCHEMA should give one schema, or '
+                         'one per ACUSIM_HTTP_BROADCAST_PORT.')
 
     platform = os.getenv('ACUSIM_PLATFORM', 'satp')
-    if platform in ['satp', '', None]:
+    if platform in ['', None]:
         platform = 'satp'
-        pconfig['status'] = 'StatusSATPDetailed8100'
-    elif platform in 'ccat':
-        pconfig['status'] = 'StatusCCATDetailed8100'
-    else:
+    if platform not in STATUS_DATASETS:
         raise ValueError(f'Invalid ACUSIM_PLATFORM: {platform}')
 
-    # Note that regardless of name from which it is served, we init it
-    # from the SATP one...
-    pdata = DataMaster('Datasets.StatusSATPDetailed8100')
-    udp = AcuUdpServer(udp_port, pdata)
+    tick_rate = float(os.getenv('ACUSIM_TICK_RATE', 200))
+    clock_rate = float(os.getenv('ACUSIM_CLOCK_RATE', 1))
+    clock_start = os.getenv('ACUSIM_CLOCK_START')
+    if clock_start not in [None, '']:
+        clock_start = float(clock_start)
+    else:
+        clock_start = None
+    clock = get_clock(clock_rate, start=clock_start)
+
+    farm_config = os.getenv('ACUSIM_CONFIG')
+    if farm_config not in [None, '']:
+        # Serve all the (local) devices from a soaculib config file.
+        names = os.getenv('ACUSIM_DEVICES')
+        if names not in [None, '']:
+            names = names.split(',')
+        else:
+            names = None
+        sims = [AcuSimulator.from_device(d, clock=clock, tick_rate=tick_rate)
+                for d in get_farm_devices(farm_config, names)]
+        http_server = 'asyncio'
+    else:
+        sims = [AcuSimulator(platform, clock=clock, tick_rate=tick_rate,
+                             streams=list(zip(udp_ports, schemas)),
+                             http_port=port)]
 
-    # start background thread updating internal ACU data
-    pdata.run()
+    for sim in sims:
+        print(f'Simulating {sim.name} ({sim.pconfig["status"]}) on port '
+              f'{sim.http_port}, streams on '
+              f'{[u.write_port for u in sim.udp_servers]}', flush=True)
+        # UDP sampling is driven by the scheduler.
+        sim.start()
 
-    flask_kwargs = {'host': 'localhost', 'port': port, 'debug': False}
-    t1 = Thread(target=app.run, kwargs=flask_kwargs)
-    t2 = Thread(target=udp.run)
+    # start scheduler thread updating internal ACU data; as a daemon,
+    # so the process still exits if the servers fail to start.
+    Thread(target=run_scheduler, args=([sim.pdata for sim in sims],),
+           daemon=True).start()
 
-    t1.start()
-    t2.start()
+    if http_server == 'asyncio':
+        asyncio.run(serve_farm(sims))
+    else:
+        app = get_flask_app(sims[0].routes)
+        flask_kwargs = {'host': 'localhost', 'port': port, 'debug': False}
+        t1 = Thread(target=app.run, kwargs=flask_kwargs)
+        t1.start()
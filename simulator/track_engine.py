@@ -0,0 +1,288 @@
+import numpy as np
+from threading import Lock
+from scipy.interpolate import CubicSpline
+
+#: Size of the ACU ProgramTrack point stack.
+STACK_SIZE = 10000
+
+#: Number of points beyond the start of a segment that must be on the
+#: stack before that segment is committed.  This mimics the 4-point
+#: window the ACU (and the previous simulator) interpolated over.
+LOOKAHEAD = 3
+
+#: Settling time (s) added after the last point of a track, when
+#: landing.  Realistic, but won't produce as large an amplitude in the
+#: settling motion (which would be ~0.8 deg).
+LANDING_OFFSET = 0.5
+
+#: Number of extra (stationary) points used to land at the end of a
+#: track.
+LANDING_POINTS = 4
+
+#: The azflags pattern identifying a turnaround group.
+TURNAROUND = (1, 2, 1, 1)
+
+
+def parse_track(lines):
+    """Decode UploadPtStack data into arrays.
+
+    The parsing is done in a single pass over the whole payload,
+    rather than line by line.
+
+    Args:
+        lines (bytes): 'utf-8' bytes encoded string with points,
+            delimited by '\\r\\n'.  See DataMaster.upload_track.
+
+    Returns:
+        Tuple of arrays (times, azs, els, azflags), where times are
+        seconds of day (as in Time_UDP).
+
+    """
+    # '168, 19:11:22.342642; 27.414830; 35.000000; 2.0000; 0.0000; 1; 0'
+    # becomes day;h;m;s;az;el;vaz;vel;azflag;elflag.
+    text = lines.decode('utf-8').translate({ord(','): ';', ord(':'): ';'})
+    rows = [r for r in text.splitlines() if r.strip()]
+    if len(rows) == 0:
+        return (np.zeros(0), np.zeros(0), np.zeros(0), np.zeros(0, dtype=int))
+    cols = np.loadtxt(rows, delimiter=';', ndmin=2).T
+    times = cols[1] * 3600. + cols[2] * 60. + cols[3]
+    if len(cols) > 8:
+        azflags = cols[8].astype(int)
+    else:
+        azflags = np.ones(len(times), dtype=int)
+    return times, cols[4], cols[5], azflags
+
+
+class TrackEngine:
+    """Piecewise-polynomial interpolation of a ProgramTrack point stack.
+
+    Points are appended with extend(), and each segment between two
+    consecutive points is converted (once) into cubic polynomial
+    coefficients for az and el.  The evaluate() method then returns
+    position and analytic velocity at some time, with a constant-time
+    segment lookup as long as successive calls are made with
+    non-decreasing times.
+
+    The segment fits follow the ACU behavior: linear interpolation
+    between normal scan points, and a single cubic through the four
+    points of a turnaround group (azflags 1, 2, 1, 1), which is used
+    for the two segments on either side of the turnaround point.  When
+    the stack runs out, land() appends a few stationary points and
+    fits a spline through them so the motion settles smoothly.
+
+    The points and the coefficients are stored in preallocated ring
+    buffers, sized like the ACU stack.  Segment k starts at point k
+    and both are stored in slot k % capacity.  The indices below are
+    absolute (they only ever increase).
+
+    Args:
+        size (int): Number of points the stack can hold.
+
+    Attributes:
+        times (array): Point times (seconds of day, as in Time_UDP).
+        azs, els (array): Point positions (deg).
+        azflags (array): Point flags.
+        origin (array): Time origin of each built segment's polynomial.
+        coefs (array): Shape (capacity, 2, 4); polynomial coefficients
+            for az and el, in increasing powers of (t - origin).
+        tail (int): Index of the next point to be written.
+        n_built (int): Index of the first segment that is not built.
+        cursor (int): Index of the segment most recently evaluated;
+            points before this one have been consumed.
+        landing (bool): True once land() has been called.
+
+    """
+    def __init__(self, size=STACK_SIZE):
+        self.size = size
+        # Leave room to land, even when the stack is full.
+        self.capacity = cap = size + LANDING_POINTS
+        self.times = np.zeros(cap)
+        self.azs = np.zeros(cap)
+        self.els = np.zeros(cap)
+        self.azflags = np.zeros(cap, dtype=int)
+        self.origin = np.zeros(cap)
+        self.coefs = np.zeros((cap, 2, 4))
+        self.tail = 0
+        self.n_built = 0
+        self.cursor = 0
+        self.landing = False
+        self._seg = None
+        # Protects the indices while the buffers are being updated.
+        self._lock = Lock()
+
+    @property
+    def remaining(self):
+        """Number of points on the stack that have not yet been passed."""
+        return self.tail - self.cursor
+
+    @property
+    def free(self):
+        """Number of free slots on the stack."""
+        return max(self.size - self.remaining, 0)
+
+    @property
+    def t_start(self):
+        """Time of the first point that has not yet been passed, or None."""
+        if self.cursor >= self.tail:
+            return None
+        return float(self.times[self.cursor % self.capacity])
+
+    @property
+    def t_end(self):
+        """End time of the last built segment, or None."""
+        if self.n_built == 0:
+            return None
+        return float(self.times[self.n_built % self.capacity])
+
+    def extend(self, times, azs, els, azflags):
+        """Append points to the stack and build coefficients for any
+        segments that have become fully determined.  Points that
+        don't fit on the stack are discarded.
+
+        Returns:
+            The number of points accepted.
+
+        """
+        with self._lock:
+            if self.landing:
+                return 0
+            n = min(len(times), self.free)
+            if n < len(times):
+                print(f'Point stack full; discarding {len(times) - n} points.',
+                      flush=True)
+            slots = np.arange(self.tail, self.tail + n) % self.capacity
+            self.times[slots] = times[:n]
+            self.azs[slots] = azs[:n]
+            self.els[slots] = els[:n]
+            self.azflags[slots] = azflags[:n]
+            self.tail += n
+            self._build(self.tail - LOOKAHEAD)
+        return n
+
+    def _build(self, stop):
+        """Compute coefficients for segments n_built up to (but not
+        including) stop.
+
+        """
+        start = self.n_built
+        if stop <= start:
+            return
+        cap = self.capacity
+        # Points start, ..., stop (inclusive) are needed.
+        slots = np.arange(start, stop + 1) % cap
+        t = self.times[slots]
+        pos = np.array([self.azs[slots], self.els[slots]])
+        seg = slots[:-1]
+
+        # Linear interpolation, everywhere.
+        dt = np.diff(t)
+        dp = np.diff(pos, axis=1)
+        slope = np.divide(dp, dt, out=np.zeros_like(dp), where=(dt > 0))
+        self.origin[seg] = t[:-1]
+        self.coefs[seg] = 0.
+        self.coefs[seg, :, 0] = pos[:, :-1].T
+        self.coefs[seg, :, 1] = slope.T
+
+        # Cubics through turnaround groups.  Matches can't overlap,
+        # since the pattern doesn't start with the value at index 1.
+        idx = np.arange(start, stop)
+        idx = idx[idx + 3 < self.tail]
+        match = np.ones(len(idx), bool)
+        for i, v in enumerate(TURNAROUND):
+            match &= (self.azflags[(idx + i) % cap] == v)
+        idx = idx[match]
+        if len(idx):
+            win = (idx[:, None] + np.arange(4)) % cap
+            tw = self.times[win] - self.times[win[:, :1]]
+            ok = np.all(np.diff(tw, axis=1) > 0, axis=1)
+            for k in win[~ok]:
+                print('Error in turnaround fit; using linear interpolation.',
+                      'TIMES:', self.times[k], flush=True)
+            idx, win, tw = idx[ok], win[ok], tw[ok]
+        if len(idx):
+            # Vandermonde systems, increasing powers; one per group.
+            vander = tw[:, :, None] ** np.arange(4)
+            rhs = np.stack([self.azs[win], self.els[win]], axis=-1)
+            c = np.linalg.solve(vander, rhs)  # (n_group, power, axis)
+            for j in [0, 1]:
+                self.origin[win[:, j]] = self.times[win[:, 0]]
+                self.coefs[win[:, j]] = c.transpose(0, 2, 1)
+            stop = max(stop, idx[-1] + 2)
+
+        self.n_built = stop
+        self._seg = None
+
+    def land(self):
+        """Stop accepting points, and append a settling motion to the
+        end of the track.  The final few points, plus some stationary
+        points after them, are fit with a spline.
+
+        """
+        with self._lock:
+            if self.landing:
+                return
+            self.landing = True
+            cap = self.capacity
+            j0 = max(self.tail - 4, 0)
+            slots = np.arange(j0, self.tail) % cap
+            if len(slots) < 2:
+                return
+            tt = self.times[slots]
+            step = np.median(np.diff(tt))
+            tl = tt[-1] + step * np.arange(1, LANDING_POINTS + 1) + LANDING_OFFSET
+            x = np.concatenate([tt, tl])
+            y = np.array([np.concatenate([p[slots], np.full(LANDING_POINTS, p[slots[-1]])])
+                          for p in [self.azs, self.els]])
+            c = CubicSpline(x, y, axis=1).c  # (power desc, seg, axis)
+
+            slots = np.arange(j0, self.tail + LANDING_POINTS) % cap
+            self.times[slots] = x
+            self.azs[slots] = y[0]
+            self.els[slots] = y[1]
+            self.azflags[slots] = 1
+            self.origin[slots[:-1]] = x[:-1]
+            self.coefs[slots[:-1]] = c[::-1].transpose(1, 2, 0)
+            self.tail += LANDING_POINTS
+            self.n_built = self.tail - 1
+            self._seg = None
+
+    def _seek(self, t):
+        with self._lock:
+            cap = self.capacity
+            k = self.cursor
+            times = self.times
+            while k < self.n_built and t >= times[(k + 1) % cap]:
+                k += 1
+            self.cursor = k
+            if k >= self.n_built:
+                self._seg = None
+            else:
+                i = k % cap
+                self._seg = (float(times[i]), float(times[(k + 1) % cap]),
+                             float(self.origin[i]),
+                             tuple(self.coefs[i, 0].tolist()),
+                             tuple(self.coefs[i, 1].tolist()))
+            return self._seg
+
+    def evaluate(self, t):
+        """Get the interpolated position and velocity at time t.
+
+        Returns:
+            None if t falls outside the built segments; otherwise the
+            tuple (az, el, az_vel, el_vel).
+
+        """
+        seg = self._seg
+        if seg is None or t >= seg[1]:
+            seg = self._seek(t)
+            if seg is None:
+                return None
+        if t < seg[0]:
+            return None
+        s = t - seg[2]
+        a0, a1, a2, a3 = seg[3]
+        e0, e1, e2, e3 = seg[4]
+        return (a0 + s * (a1 + s * (a2 + s * a3)),
+                e0 + s * (e1 + s * (e2 + s * e3)),
+                a1 + s * (2 * a2 + 3 * a3 * s),
+                e1 + s * (2 * e2 + 3 * e3 * s))
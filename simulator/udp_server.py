@@ -1,88 +1,138 @@
-import time
+import logging
 import struct
 import socket
 
+logger = logging.getLogger(__name__)
 
-UDP_KEYS = [
-    'Day',
-    'Time_UDP',
-    'Corrected Azimuth',
-    'Corrected Elevation',
-    'Corrected Boresight',
-    'Raw Azimuth',
-    'Raw Elevation',
-    'Raw Boresight',
-    'Azimuth Current 1',
-    'Azimuth Current 2',
-    'Elevation Current 1',
-    'Boresight Current 1',
-    'Boresight Current 2']
+
+#: The v2 stream schema (as in acu-configs.yaml); used if no schema is
+#: specified.
+DEFAULT_SCHEMA = {
+    'format': '<idddddddddddd',
+    'fields': ['Day', 'Time', 'Corrected_Azimuth', 'Corrected_Elevation',
+               'Corrected_Boresight', 'Raw_Azimuth', 'Raw_Elevation',
+               'Raw_Boresight', 'Azimuth_Current_1', 'Azimuth_Current_2',
+               'Elevation_Current_1', 'Boresight_Current_1',
+               'Boresight_Current_2'],
+}
+
+#: Stream schema fields that don't correspond to the DataMaster key
+#: obtained by replacing underscores with spaces.
+FIELD_KEYS = {
+    'Time': 'Time_UDP',
+    'Azimuth': 'Corrected Azimuth',
+    'Elevation': 'Corrected Elevation',
+}
+
+
+def field_key(field):
+    """Return the DataMaster data key for a stream schema field."""
+    return FIELD_KEYS.get(field, field.replace('_', ' '))
 
 
 class AcuUdpServer:
     """Class meant to mimic the ACU UDP Server.
 
+    Samples are taken from the DataMaster snapshot on scheduler ticks
+    (at most once per sample_period of simulated time), packed in
+    place into a reusable buffer using the compiled stream schema,
+    and sent out once pkt_size samples have accumulated.
+
+    At most one sample is taken per tick, so the sample rate is
+    limited by the scheduler tick rate (ACUSIM_TICK_RATE); run() warns
+    if that's too low.
+
+    Fields in the schema that the DataMaster does not track (such as
+    the extra motor currents in v3) are sent as zero.
+
+    The stream can be disabled, and its destination changed, through
+    the developer interface (see dev_interface.py).
+
     args:
         write_port (int): Port to write UDP packets to
         data_object (DataMaster): ACU emulating data object
+        schema (dict): Stream schema, with entries 'format' and
+            'fields' (see stream_schemas in acu-configs.yaml).
+            Defaults to DEFAULT_SCHEMA.
+        host (str): Host to send UDP packets to.
+        acu_name (str): Name of the stream's ACU module, without the
+            'Services.' prefix.
 
     """
-    def __init__(self, write_port, data_object):
-        self.pkt_size = 10
-        self.fmt = '<' + 'idddddddddddd'*self.pkt_size
+    pkt_size = 10
+    sample_period = 0.005
+
+    def __init__(self, write_port, data_object, schema=None, host='localhost',
+                 acu_name='PositionBroadcast'):
+        if schema is None:
+            schema = DEFAULT_SCHEMA
         self.write_port = write_port
+        self.host = host
+        self.acu_name = acu_name
+        self.enabled = True
+        self.packets_sent = 0
         self.data_object = data_object
-        self.data = data_object.data
+        self.schema = schema
+        self.sample = struct.Struct(schema['format'])
+        self.keys = [field_key(f) for f in schema['fields']]
+        if len(self.keys) != len(self.sample.unpack(bytes(self.sample.size))):
+            raise ValueError('Stream schema format and fields do not match.')
+        self.buf = bytearray(self.sample.size * self.pkt_size)
+        self.n_samples = 0
         self.next_sample_time = None
+        self.sock = None
 
-    def _build_udp_data(self):
-        """Retreive (and update) the values from the DataMaster.
+    def add_sample(self, now, data):
+        """Pack the current values into the next sample slot of the
+        packet buffer, and send the packet if it's full.  This is
+        registered as a DataMaster tick listener by run().
 
-        The full data from DataMaster is more than the UDP needs to report, so
-        we then limit just to the info in UDP_KEYS.
+        Args:
+            now (float): The simulated time of the tick.
+            data (mapping): Snapshot of the DataMaster data.
 
         """
-        all_data = self.data_object.values()
-        udp_data = {}
-        for key in UDP_KEYS:
-            udp_data[key] = all_data[key]
-        return udp_data
-
-    def set_values(self):
-        """Build the struct to send over UDP to the ACU Agent."""
-        # Fetch values from DataMaster object
-        pkt_values = {k: [] for k in UDP_KEYS}
-        for i in range(self.pkt_size):
-            # Wait until the next sample time.
-            now = time.time()
-            dt = self.next_sample_time - now
-            if dt > 0:
-                time.sleep(dt)
-            self.next_sample_time += 0.005
-            self.data = self._build_udp_data()
-            for k, v in self.data.items():
-                pkt_values[k].append(v)
-
-        # Build list for struct
-        _values = []
-        for i in range(self.pkt_size):
-            _values.extend([pkt_values[item][i] for item in UDP_KEYS])
-
-        pack = struct.pack(self.fmt, *_values)
-
-        return pack
+        if not self.enabled or now < self.next_sample_time:
+            return
+        self.next_sample_time += self.sample_period
+        if self.next_sample_time <= now:
+            # Fell behind; don't try to catch up.
+            self.next_sample_time = now + self.sample_period
+        self.sample.pack_into(self.buf, self.n_samples * self.sample.size,
+                              *[data.get(k, 0) for k in self.keys])
+        self.n_samples += 1
+        if self.n_samples == self.pkt_size:
+            try:
+                self.sock.sendto(self.buf, (self.host, self.write_port))
+                self.packets_sent += 1
+            except OSError:
+                # E.g. unreachable Destination; the ACU wouldn't care.
+                pass
+            self.n_samples = 0
+
+    def enable(self, enabled=True):
+        """Start (or stop) sending packets."""
+        if enabled and not self.enabled:
+            self.n_samples = 0
+            self.next_sample_time = self.data_object.now()
+        self.enabled = enabled
 
     def run(self):
         """Run the server.
 
-        At 20 Hz we build a packet of 10 data points and send it out to the ACU Agent.
+        At 200 Hz (in simulated time) we take a sample, and send out
+        packets of 10 samples to the ACU Agent.  The sampling is
+        driven by the DataMaster scheduler, so this returns
+        immediately.
 
         """
-        host = "localhost"
-        port = self.write_port
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.next_sample_time = int(time.time() + 1)
-
-        while True:
-            pkt = self.set_values()
-            sock.sendto(pkt, (host, port))
+        tick_period = self.data_object.tick_period
+        if tick_period > self.sample_period:
+            logger.warning(
+                '%s on port %i: sample rate (%g Hz) is higher than the '
+                'tick rate (%g Hz); samples will be dropped.  Increase '
+                'ACUSIM_TICK_RATE.', self.acu_name, self.write_port,
+                1. / self.sample_period, 1. / tick_period)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.next_sample_time = int(self.data_object.now() + 1)
+        self.data_object.add_listener(self.add_sample)
@@ -0,0 +1,97 @@
+import pytest
+
+import soaculib
+from soaculib.http import CommandError
+
+
+# Backends that don't touch the network: each request is answered
+# immediately with a canned decoded result, and recorded.
+
+def _reply(backend, req):
+    backend.requests.append(req)
+    if req.decoder.rtype == 'json':
+        return {'Mode': 'Stop'}
+    return backend.command_reply
+
+
+class NullStandardBackend(soaculib.StandardBackend):
+    def execute(self, req):
+        yield _reply(self, req)
+
+
+class NoGatherBackend(NullStandardBackend):
+    gather = None
+
+
+def _twisted_backends():
+    try:
+        from twisted.internet.defer import succeed
+        from soaculib.twisted_backend import TwistedHttpBackend
+        from soaculib.retwisted_backend import RetwistedHttpBackend
+    except ImportError:
+        return []
+
+    class NullTwistedBackend(TwistedHttpBackend):
+        def execute(self, req):
+            return succeed(_reply(self, req))
+
+    class NullRetwistedBackend(RetwistedHttpBackend):
+        def execute(self, req):
+            return succeed(_reply(self, req))
+
+    return [NullTwistedBackend, NullRetwistedBackend]
+
+
+BACKENDS = [NullStandardBackend, NoGatherBackend] + _twisted_backends()
+
+
+def _result(x):
+    """Get the result of a call, which might be a (fired) Deferred."""
+    if not hasattr(x, 'addCallbacks'):
+        return x
+    out = []
+    x.addCallbacks(out.append, out.append)
+    assert len(out) == 1
+    if hasattr(out[0], 'raiseException'):
+        out[0].raiseException()
+    return out[0]
+
+
+def _acu(backend_class, command_reply='OK, Command executed.'):
+    backend = backend_class()
+    backend.requests = []
+    backend.command_reply = command_reply
+    acu = soaculib.AcuControl(soaculib.guess_config('simulator'),
+                              backend=backend)
+    return acu, backend
+
+
+@pytest.mark.parametrize('backend_class', BACKENDS)
+def test_batch(backend_class):
+    acu, backend = _acu(backend_class)
+    _result(acu.go_to(1., 2.))
+    params = [r.params for r in backend.requests]
+    assert [p['identifier'] for p in params] == [
+        'DataSets.CmdAzElPositionTransfer', 'DataSets.CmdModeTransfer']
+    assert params[0]['parameter'] == '1.0000|2.0000'
+
+    backend.requests = []
+    _result(acu.set_rate(az=1.))
+    assert len(backend.requests) > 0
+
+
+@pytest.mark.parametrize('backend_class', BACKENDS)
+def test_batch_error(backend_class):
+    acu, backend = _acu(backend_class, command_reply='command not found')
+    with pytest.raises(CommandError):
+        _result(acu.go_to(1., 2.))
+    # The mode command is not sent after the position command fails.
+    assert len(backend.requests) == 1
+
+
+@pytest.mark.parametrize('backend_class', BACKENDS)
+def test_stream_group(backend_class):
+    acu, backend = _acu(backend_class)
+    results = _result(acu.streams.enable())
+    assert results == {name: 'ok' for name in acu.streams}
+    assert len(backend.requests) == len(acu.streams)
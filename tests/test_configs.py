@@ -0,0 +1,12 @@
+import soaculib
+from soaculib import configs
+
+
+def test_acucontrol_from_dict():
+    # A dict config is used as-is, but the stream schemas still come
+    # from the config file, which might not have been loaded yet.
+    cfg = dict(soaculib.guess_config('simulator'))
+    configs.cache = None
+    acu = soaculib.AcuControl(cfg)
+    assert acu._config is cfg
+    assert configs.cache is not None